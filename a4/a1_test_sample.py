@@ -19,11 +19,17 @@ Note: this file is for support purposes only, and is not part of your
 submission.
 """
 from datetime import datetime, timedelta
+import json
 import os
+import subprocess
+import sys
+import tempfile
 import pygame
 from pytest import approx
-from bikeshare import Ride, Station
-from simulation import Simulation, create_stations, create_rides
+from bikeshare import Ride, Station, from_minutes, to_minutes
+from container import HeapPriorityQueue, PriorityQueue, TimeWheelQueue
+from simulation import Simulation, Event, RideStartEvent, create_stations, \
+    create_rides, stream_rides
 
 
 ###############################################################################
@@ -177,6 +183,863 @@ def test_ride_ends_outside_run():
     )
 
 
+def test_discrete_run_matches_minute_run():
+    """Test that jumping between event times gives the same station
+    statistics as stepping through every minute.
+    """
+    results = []
+    for discrete in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        sim.run(datetime(2017, 6, 1, 8, 0, 0),
+                datetime(2017, 6, 1, 9, 0, 0), discrete)
+        results.append({station_id: station.stats
+                        for station_id, station in sim.all_stations.items()})
+    assert results[0] == results[1]
+
+
+def test_discrete_run_matches_minute_run_reversed():
+    """Test that both ways of stepping agree on a window that ends before
+    it starts, and that no negative time is credited.
+    """
+    results = []
+    for discrete in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        sim.run(datetime(2017, 6, 1, 9, 0, 0),
+                datetime(2017, 6, 1, 8, 0, 0), discrete)
+        results.append({station_id: (list(station.counts), station.num_bikes)
+                        for station_id, station in sim.all_stations.items()})
+    assert results[0] == results[1]
+    assert all(count >= 0 for counts, _ in results[1].values()
+               for count in counts)
+
+
+def test_chained_runs_match_one_run():
+    """Test that running a simulation from a to b and then from b to c
+    gives the same statistics and state as running it from a to c, whichever
+    way the rides are stored and the time is stepped.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    middle = datetime(2017, 6, 1, 8, 30, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    for columnar in [False, True]:
+        for discrete in [False, True]:
+            expected = Simulation('stations.json', 'sample_rides.csv',
+                                  headless=True, columnar=columnar)
+            expected_stats = expected.run(start, end, discrete)
+            sim = Simulation('stations.json', 'sample_rides.csv',
+                             headless=True, columnar=columnar)
+            sim.run(start, middle, discrete)
+            assert sim.run(middle, end, discrete) == expected_stats
+            assert sim.get_state(end) == expected.get_state(end)
+
+
+###############################################################################
+# Tests for slotted objects
+###############################################################################
+def test_slotted_objects():
+    """Test that stations, rides and events have no instance dictionaries,
+    and that station statistics can still be read by name.
+    """
+    stations = create_stations('stations.json')
+    ride = create_rides('sample_rides.csv', stations)[0]
+    event = RideStartEvent(None, ride.start_minute, ride)
+    for obj in (ride.start, ride, event):
+        assert not hasattr(obj, '__dict__')
+    ride.start.record(0, 2)
+    ride.start.record(3, 60)
+    assert ride.start.counts == [2, 0, 0, 60]
+    assert ride.start.stats == {'starting rides': 2, 'ending rides': 0,
+                                'low availability': 0, 'low unoccupied': 60}
+    assert ride.get_position(ride.start_time) == ride.start.location
+
+
+def test_station_stats_write_through():
+    """Test that changing a statistic by name changes the station's counts
+    and its place on the leaderboard.
+    """
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    station = sim.all_stations['6001']
+    station.stats['ending rides'] += 5
+    assert station.counts[1] == 5
+    assert station.stats['ending rides'] == 5
+    assert sim.leaderboard.leader('ending rides') == (station.name, 5)
+    try:
+        del station.stats['ending rides']
+    except TypeError:
+        pass
+    else:
+        assert False, 'statistics should not be removable'
+
+
+###############################################################################
+# Tests for streaming ride loading
+###############################################################################
+def test_stream_rides_matches_create_rides():
+    """Test that stream_rides reads the same rides as create_rides, and only
+    keeps the rides that overlap the given window.
+    """
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)
+    streamed = list(stream_rides('sample_rides.csv', stations))
+    assert [(r.start, r.end, r.start_time, r.end_time) for r in rides] == \
+        [(r.start, r.end, r.start_time, r.end_time) for r in streamed]
+
+    start = datetime(2017, 6, 1, 8, 50, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    window = list(stream_rides('sample_rides.csv', stations, start, end))
+    assert [r.start_time for r in window] == \
+        [r.start_time for r in rides
+         if r.end_time >= start and r.start_time <= end]
+    assert len(window) == 5
+
+
+###############################################################################
+# Tests for columnar ride storage
+###############################################################################
+def test_ride_table_matches_create_rides():
+    """Test that a RideTable holds the same rides as create_rides."""
+    from ridetable import load_ride_table
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)
+    table = load_ride_table('sample_rides.csv', stations)
+    assert len(table) == len(rides)
+    for i, ride in enumerate(rides):
+        row = table.ride(i)
+        assert (row.start, row.end, row.start_time, row.end_time) == \
+            (ride.start, ride.end, ride.start_time, ride.end_time)
+
+
+def test_ride_positions_match_get_position():
+    """Test that the positions of many rides calculated together are the
+    same as those from Ride.get_position, for rides that are just starting,
+    mid-trip and just ending, and from frame to frame as rides come and go.
+    """
+    from ridetable import RideMotions, ride_positions
+    stations = create_stations('stations.json')
+    rides = create_rides('sample_rides.csv', stations)[:40]
+    motions = RideMotions(4)
+    for ride in rides:
+        duration = ride.end_time - ride.start_time
+        for time in [ride.start_time, ride.start_time + timedelta(seconds=1),
+                     ride.start_time + duration / 2,
+                     ride.end_time - timedelta(seconds=1), ride.end_time]:
+            drawn = [other for other in rides
+                     if other.start_time <= time <= other.end_time]
+            expected = [coordinate for other in drawn
+                        for coordinate in other.get_position(time)]
+            assert ride_positions(drawn, time).ravel().tolist() == \
+                approx(expected)
+            assert motions.positions(drawn, time).ravel().tolist() == \
+                approx(expected)
+
+
+def test_columnar_simulation_statistics():
+    """Test that a columnar simulation finds the same rides and gives the
+    same statistics as one that holds a list of rides.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 30, 0)
+    listed = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    columnar = Simulation('stations.json', 'sample_rides.csv', headless=True,
+                          columnar=True)
+    # The table is indexed by minute, and finds the same rides in the same
+    # order as the list.
+    assert columnar.all_rides.minute_index() is not None
+    first, last = to_minutes(start), to_minutes(end)
+    for find in ['_rides_starting', '_rides_in_progress']:
+        args = (first, last) if find == '_rides_starting' else (last,)
+        assert [(r.start.name, r.end.name, r.start_minute, r.end_minute)
+                for r in getattr(columnar, find)(*args)] == \
+            [(r.start.name, r.end.name, r.start_minute, r.end_minute)
+             for r in getattr(listed, find)(*args)]
+    assert listed.run(start, end) == columnar.run(start, end)
+
+
+def test_dataset_simulation_statistics():
+    """Test that a simulation opened from a compiled dataset gives the same
+    statistics as one that reads the stations and rides files.
+    """
+    from dataset import compile_dataset
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 30, 0)
+    with tempfile.TemporaryDirectory() as folder:
+        dataset_file = os.path.join(folder, 'june.bikes')
+        compile_dataset('stations.json', 'sample_rides.csv', dataset_file)
+        compiled = Simulation.from_dataset(dataset_file, headless=True)
+        stats = compiled.run(start, end)
+        del compiled
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    assert stats == sim.run(start, end)
+
+
+def test_rides_in_progress_at_start():
+    """Test that rides already in progress when a run starts are returned
+    to their end stations, whichever way the rides are stored.
+
+    Five rides are in progress at 8:50, but two of them end at full stations.
+    """
+    from dataset import compile_dataset
+    start = datetime(2017, 6, 1, 8, 50, 0)
+    end = datetime(2017, 6, 1, 9, 10, 0)
+    with tempfile.TemporaryDirectory() as folder:
+        dataset_file = os.path.join(folder, 'june.bikes')
+        compile_dataset('stations.json', 'sample_rides.csv', dataset_file)
+        sims = [Simulation('stations.json', 'sample_rides.csv', True),
+                Simulation('stations.json', 'sample_rides.csv', True, True),
+                Simulation.from_dataset(dataset_file, True)]
+        results = [sim.run(start, end) for sim in sims]
+    for sim, stats in zip(sims, results):
+        assert stats == results[0]
+        assert sum(station.stats['ending rides']
+                   for station in sim.all_stations.values()) == 3
+        assert sum(station.stats['starting rides']
+                   for station in sim.all_stations.values()) == 0
+
+
+###############################################################################
+# Tests for headless simulations
+###############################################################################
+def test_headless_statistics():
+    """Test that a headless run returns the same statistics as
+    test_statistics_simple expects, in both run modes.
+    """
+    for discrete in [False, True]:
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        stats = sim.run(datetime(2017, 6, 1, 9, 30, 0),
+                        datetime(2017, 6, 1, 9, 45, 0), discrete)
+        assert stats == sim.calculate_statistics()
+        assert stats['max_start'] == (sim.all_stations['6091'].name, 1)
+        assert stats['max_end'] == (sim.all_stations['6052'].name, 1)
+        assert stats['max_time_low_availability'] == (
+            '15e avenue / Masson', 900)
+        assert stats['max_time_low_unoccupied'] == (
+            '10e Avenue / Rosemont', 900)
+
+
+def test_headless_does_not_import_pygame():
+    """Test that a headless simulation never imports pygame."""
+    code = ('import sys\n'
+            'from datetime import datetime\n'
+            'from simulation import Simulation\n'
+            'sim = Simulation("stations.json", "sample_rides.csv", True)\n'
+            'sim.run(datetime(2017, 6, 1, 8), datetime(2017, 6, 1, 9))\n'
+            'assert "pygame" not in sys.modules\n')
+    subprocess.run([sys.executable, '-c', code], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_resume_matches_uninterrupted_run():
+    """Test that resuming from a snapshot gives the same statistics, station
+    by station, as a run that was never interrupted, in both run modes.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 10, 0, 0)
+    for discrete in [False, True]:
+        full = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        expected = full.run(start, end, discrete)
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot = os.path.join(folder, 'snapshot')
+            first = Simulation('stations.json', 'sample_rides.csv',
+                               headless=True)
+            first.run(start, datetime(2017, 6, 1, 9, 0, 0), discrete,
+                      snapshot, timedelta(minutes=20))
+            for _ in range(2):
+                sim = Simulation('stations.json', 'sample_rides.csv',
+                                 headless=True)
+                assert sim.resume(snapshot, end, discrete) == expected
+                for station_id, station in sim.all_stations.items():
+                    assert station.stats == \
+                        full.all_stations[station_id].stats
+                    assert station.num_bikes == \
+                        full.all_stations[station_id].num_bikes
+
+
+###############################################################################
+# Tests for batch simulations
+###############################################################################
+def test_run_windows_matches_single_runs():
+    """Test that each window of a batch gives the same statistics as its own
+    fresh simulation, even though workers reuse their simulation.
+    """
+    from batch import run_windows
+    windows = [(datetime(2017, 6, 1, 8, 0, 0), datetime(2017, 6, 1, 8, 30, 0)),
+               (datetime(2017, 6, 1, 8, 30, 0), datetime(2017, 6, 1, 9, 0, 0)),
+               (datetime(2017, 6, 1, 8, 0, 0), datetime(2017, 6, 1, 9, 45, 0))]
+    table = run_windows('stations.json', 'sample_rides.csv', windows * 2,
+                        max_workers=2)
+    assert len(table) == 6
+    for row, (start, end) in zip(table, windows * 2):
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        expected = sim.run(start, end)
+        assert (row['start'], row['end']) == (start, end)
+        assert {key: row[key] for key in expected} == expected
+
+
+###############################################################################
+# Tests for generated workloads
+###############################################################################
+def test_generated_workload_is_reproducible():
+    """Test that a generated workload can be loaded, has the requested size
+    and rush hours, and is the same every time for the same seed.
+    """
+    from workload import generate_rides, generate_stations
+    with tempfile.TemporaryDirectory() as folder:
+        contents = []
+        for copy in range(2):
+            stations_file = os.path.join(folder, 'stations{}.json'
+                                         .format(copy))
+            rides_file = os.path.join(folder, 'rides{}.csv'.format(copy))
+            generate_stations(stations_file, 50, seed=7)
+            assert generate_rides(stations_file, rides_file, 3000,
+                                  seed=7) == 2
+            with open(rides_file) as file:
+                contents.append(file.read())
+        stations = create_stations(stations_file)
+        rides = create_rides(rides_file, stations)
+    assert contents[0] == contents[1]
+    assert len(stations) == 50
+    assert len(rides) == 3000
+    assert all(rides[i].start_time <= rides[i + 1].start_time
+               for i in range(len(rides) - 1))
+    rush = sum(ride.start_time.hour in (7, 8, 16, 17, 18) for ride in rides)
+    assert rush > len(rides) / 3
+
+
+###############################################################################
+# Tests for partitioned simulations
+###############################################################################
+def test_partitioned_run_matches_sequential_run():
+    """Test that a run split into days gives every station the same
+    statistics and bikes as a sequential run, even when the guessed start
+    states are wrong and partitions have to be run again.
+    """
+    import partition
+    from workload import FIRST_DAY, generate_rides, generate_stations
+    start, end = FIRST_DAY, FIRST_DAY + timedelta(days=4, hours=6)
+    guess_states = partition._guess_states
+
+    def wrong_guesses(simulation, boundaries):
+        states = guess_states(simulation, boundaries)
+        for state in states:
+            state['active rides'] = []
+        return states
+
+    with tempfile.TemporaryDirectory() as folder:
+        stations_file = os.path.join(folder, 'stations.json')
+        rides_file = os.path.join(folder, 'rides.csv')
+        generate_stations(stations_file, 30, seed=3)
+        generate_rides(stations_file, rides_file, 3000, seed=3)
+        for discrete, guesses in [(True, guess_states), (False, guess_states),
+                                  (True, wrong_guesses)]:
+            partition._guess_states = guesses
+            try:
+                expected = Simulation(stations_file, rides_file,
+                                      headless=True)
+                expected_stats = expected.run(start, end, discrete)
+                sim = Simulation(stations_file, rides_file, headless=True)
+                stats, reruns = partition.run_partitioned(
+                    sim, start, end, discrete, max_workers=2)
+            finally:
+                partition._guess_states = guess_states
+            assert stats == expected_stats
+            assert sim.get_state(end) == expected.get_state(end)
+            assert (reruns > 0) == (guesses is wrong_guesses)
+
+
+def test_partitioned_run_docks_active_rides_later():
+    """Test that the rides still active at the end of a partitioned run
+    are docked by a later run of the same simulation, as after a sequential
+    run.
+    """
+    import partition
+    from workload import FIRST_DAY, generate_rides, generate_stations
+    start, end = FIRST_DAY, FIRST_DAY + timedelta(days=1, hours=17)
+    later = end + timedelta(hours=12)
+    with tempfile.TemporaryDirectory() as folder:
+        stations_file = os.path.join(folder, 'stations.json')
+        rides_file = os.path.join(folder, 'rides.csv')
+        generate_stations(stations_file, 30, seed=3)
+        generate_rides(stations_file, rides_file, 3000, seed=3)
+        expected = Simulation(stations_file, rides_file, headless=True)
+        expected.run(start, end, True)
+        sim = Simulation(stations_file, rides_file, headless=True)
+        partition.run_partitioned(sim, start, end, True, max_workers=2)
+        assert sim.active_rides
+        for simulation in (sim, expected):
+            simulation._advance(to_minutes(end) + 1, to_minutes(later), True,
+                                None, 60)
+        assert not sim.active_rides
+        assert sim.get_state(later) == expected.get_state(later)
+
+
+def test_partitioned_run_starting_mid_day():
+    """Test that a partitioned run that starts while rides are out gives
+    the same statistics and state as a sequential run.
+    """
+    import partition
+    from workload import FIRST_DAY, generate_rides, generate_stations
+    start = FIRST_DAY + timedelta(hours=5, minutes=7)
+    end = FIRST_DAY + timedelta(days=2, hours=10)
+    with tempfile.TemporaryDirectory() as folder:
+        stations_file = os.path.join(folder, 'stations.json')
+        rides_file = os.path.join(folder, 'rides.csv')
+        generate_stations(stations_file, 60, seed=4)
+        generate_rides(stations_file, rides_file, 6000, seed=4)
+        expected = Simulation(stations_file, rides_file, headless=True)
+        assert list(expected._rides_in_progress(to_minutes(start)))
+        expected_stats = expected.run(start, end, True)
+        sim = Simulation(stations_file, rides_file, headless=True)
+        stats, _ = partition.run_partitioned(sim, start, end, True,
+                                             max_workers=2)
+    assert stats == expected_stats
+    assert sim.get_state(end) == expected.get_state(end)
+
+
+###############################################################################
+# Tests for leaderboards
+###############################################################################
+def test_leaderboard_matches_full_scan():
+    """Test that the leaderboard agrees with checking every station, both
+    for the leader and for the top stations, at every minute of a run.
+    """
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    sim.event_priority.add_all(
+        RideStartEvent(sim, ride.start_minute, ride)
+        for ride in sim.all_rides if ride.start_time >= start)
+    for minute in range(0, 90, 7):
+        sim._run_minutes(to_minutes(start) + minute,
+                         to_minutes(start) + minute + 7)
+        for stat in ['starting rides', 'ending rides', 'low availability',
+                     'low unoccupied']:
+            ranked = sorted(sim.all_stations.values(),
+                            key=lambda s: (-s.stats[stat], s.name))
+            assert sim.leaderboard.leader(stat) == \
+                sim.concise_stats(sim.all_stations, stat)
+            assert sim.top_k(stat, 10) == \
+                [(s.name, s.stats[stat]) for s in ranked[:10]]
+
+
+###############################################################################
+# Tests for profiling
+###############################################################################
+def test_profiled_run():
+    """Test that profiling a run records every step and phase, saves its
+    report, and doesn't change the statistics.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    expected = Simulation('stations.json', 'sample_rides.csv',
+                          headless=True).run(start, end)
+    with tempfile.TemporaryDirectory() as folder:
+        report_file = os.path.join(folder, 'report.json')
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        profiler = sim.profile(report_file)
+        assert sim.run(start, end) == expected
+        with open(report_file) as file:
+            report = json.load(file)
+    assert report == json.loads(json.dumps(profiler.report()))
+    assert profiler.calls['run'] == 1
+    assert profiler.calls['events'] == 61
+    assert profiler.calls['availability'] == 60
+    assert profiler.calls['render'] == 0
+    assert [step[0] for step in profiler.steps] == \
+        [start + timedelta(minutes=minute) for minute in range(61)]
+    assert profiler.steps[-1][2] == len(sim.active_rides)
+    assert report['peak active rides'] == \
+        max(active for _, _, active in profiler.steps)
+
+
+def test_profiler_keeps_recent_steps():
+    """Test that a profiler keeps only its most recent steps, but still
+    reports the peaks over all of them.
+    """
+    from profiling import Profiler
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+    everything = sim.profile()
+    recent = Profiler(max_steps=10)
+    recent.attach(sim)
+    sim.run(start, datetime(2017, 6, 1, 9, 0, 0))
+    assert len(everything.steps) == 61
+    assert list(recent.steps) == list(everything.steps)[-10:]
+    assert recent.calls['events'] == 61
+    assert (recent.peak_queue, recent.peak_active) == \
+        (max(queue for _, queue, _ in everything.steps),
+         max(active for _, _, active in everything.steps))
+    assert recent.report()['steps'][0][0] == \
+        (start + timedelta(minutes=51)).isoformat()
+
+
+###############################################################################
+# Tests for occupancy recording
+###############################################################################
+def test_occupancy_history():
+    """Test that the recorded occupancy of every station is the same for
+    minute-by-minute and discrete runs, ends in the station's final state,
+    gives the right extremes, and survives being saved and loaded.
+    """
+    from occupancy import load_occupancy
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    recorders = []
+    for discrete in (False, True):
+        sim = Simulation('stations.json', 'sample_rides.csv', headless=True)
+        recorders.append(sim.record_occupancy(capacity=16))
+        sim.run(start, end, discrete)
+    minutes, discrete = recorders
+    assert len(minutes) == len(discrete) > len(sim.all_stations)
+
+    with tempfile.TemporaryDirectory() as folder:
+        occupancy_file = os.path.join(folder, 'occupancy.bin')
+        discrete.save(occupancy_file)
+        loaded = load_occupancy(occupancy_file)
+    times = [start + timedelta(minutes=minute) for minute in range(61)]
+    for station_id, station in sim.all_stations.items():
+        history = minutes.history(station_id)
+        assert history[0][0] == start
+        assert history == discrete.history(station_id) == \
+            loaded.history(station_id)
+        assert loaded.occupancy(station_id, end) == \
+            (station.num_bikes, station.unocc_spots)
+        states = [loaded.occupancy(station_id, time) for time in times[10:40]]
+        assert loaded.extremes(station_id, times[10], times[39]) == \
+            (min(bikes for bikes, _ in states),
+             max(bikes for bikes, _ in states))
+        assert loaded.extremes(station_id, times[10], times[39],
+                               'unocc_spots') == \
+            (min(spots for _, spots in states),
+             max(spots for _, spots in states))
+
+
+###############################################################################
+# Tests for render policies
+###############################################################################
+def test_render_policy_skips_frames():
+    """Test that a render policy limits the frames drawn during a run, but
+    still draws the last step, without changing the statistics.
+    """
+    from visualizer import RenderPolicy
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 0, 0)
+    expected = Simulation('stations.json', 'sample_rides.csv',
+                          headless=True).run(start, end)
+    policies = [(RenderPolicy(every=timedelta(minutes=15)), False, 5),
+                (RenderPolicy(max_fps=0.01), False, 2),
+                (RenderPolicy(max_fps=0.01), True, 2)]
+    for policy, discrete, frames in policies:
+        sim = Simulation('stations.json', 'sample_rides.csv',
+                         render_policy=policy)
+        profiler = sim.profile()
+        pygame.event.post(pygame.event.Event(pygame.QUIT, {}))
+        assert sim.run(start, end, discrete) == expected
+        assert profiler.calls['render'] == frames
+
+
+def test_render_policy_rejects_bad_max_fps():
+    """Test that a render policy can't be made with a frame rate that isn't
+    positive.
+    """
+    from visualizer import RenderPolicy
+    for max_fps in [0, -1]:
+        try:
+            RenderPolicy(max_fps=max_fps)
+        except ValueError:
+            pass
+        else:
+            assert False, 'max_fps={} should be rejected'.format(max_fps)
+
+
+def test_offscreen_frames_saved():
+    """Test that an offscreen simulation saves every frame its render policy
+    draws as a PNG file of the window's size by the time each run returns,
+    and stops its writer thread until the next run.
+    """
+    from visualizer import SCREEN_SIZE, RenderPolicy
+    with tempfile.TemporaryDirectory() as folder:
+        sim = Simulation('stations.json', 'sample_rides.csv',
+                         render_policy=RenderPolicy(
+                             every=timedelta(minutes=15)),
+                         frame_dir=folder)
+        # The second run's first step was drawn as the end of the first.
+        for run, count in [(0, 5), (1, 9)]:
+            start = datetime(2017, 6, 1, 8 + run, 0, 0)
+            sim.run(start, start + timedelta(hours=1))
+            assert sim.visualizer._writer._thread is None
+            names = sorted(os.listdir(folder))
+            assert names == ['frame_{:06d}.png'.format(i)
+                             for i in range(count)]
+        for name in names:
+            image = pygame.image.load(os.path.join(folder, name))
+            assert image.get_size() == SCREEN_SIZE
+
+
+###############################################################################
+# Tests for the station grid
+###############################################################################
+def test_station_grid_matches_brute_force():
+    """Test that the grid's queries find the same stations as checking every
+    station.
+    """
+    from bikeshare import StationGrid, distance
+    stations = list(create_stations('stations.json').values())
+    grid = StationGrid(stations)
+    for location in [(-73.57, 45.51), (-73.62, 45.45), (-73.40, 45.70)]:
+        ordered = sorted(stations, key=lambda s: (
+            distance(location, s.location), s.name))
+        for k in [1, 10, 600]:
+            assert grid.nearest(location, k) == ordered[:k]
+        assert grid.within(location, 1500) == \
+            [s for s in ordered if distance(location, s.location) <= 1500]
+        corner = (location[0] + 0.05, location[1] + 0.03)
+        assert set(grid.in_box(location, corner)) == \
+            {s for s in stations
+             if location[0] <= s.location[0] <= corner[0] and
+             location[1] <= s.location[1] <= corner[1]}
+
+
+def test_drawables_culled_to_visible_area():
+    """Test that only the stations in the visible part of the map are drawn
+    once the map is zoomed in.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    sim = Simulation('stations.json', 'sample_rides.csv')
+    assert len(sim._drawables()) == len(sim.all_stations)
+
+    sim.visualizer._map.zoom(2)
+    sim.visualizer._map.pan((-2000, -1500))
+    (min_long, min_lat), (max_long, max_lat) = sim.visualizer.visible_area()
+    visible = [s for s in sim.all_stations.values()
+               if min_long <= s.location[0] <= max_long and
+               min_lat <= s.location[1] <= max_lat]
+    assert 0 < len(visible) < len(sim.all_stations)
+    assert set(sim._drawables()) == set(visible)
+
+
+def test_batched_screen_positions():
+    """Test that converting many locations to pixels at once gives the same
+    pixels as converting them one at a time, whatever the view.
+    """
+    import numpy as np
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    sim = Simulation('stations.json', 'sample_rides.csv')
+    view = sim.visualizer._map
+    locations = [station.location for station in sim.all_stations.values()]
+    for zoom, pan in [(0, (0, 0)), (1.3, (-900, -700)), (1.5, (-3000, 0))]:
+        view.zoom(zoom)
+        view.pan(pan)
+        assert view._to_screen(np.array(locations)).tolist() == \
+            [list(view._latlong_to_screen(location))
+             for location in locations]
+    pygame.event.post(pygame.event.Event(pygame.QUIT, {}))
+    sim.run(datetime(2017, 6, 1, 8, 0, 0), datetime(2017, 6, 1, 8, 30, 0))
+    assert set(view._pixels) <= set(sim.all_stations.values())
+
+
+def test_map_without_numpy():
+    """Test that a map draws rides and stations without NumPy, at the same
+    pixels as it would with it.
+    """
+    code = ('import os, sys\n'
+            'sys.modules["numpy"] = None\n'
+            'os.environ["SDL_VIDEODRIVER"] = "dummy"\n'
+            'from datetime import datetime\n'
+            'import pygame\n'
+            'from simulation import Simulation\n'
+            'from visualizer import SCREEN_SIZE, Map\n'
+            'sim = Simulation("stations.json", "sample_rides.csv", True)\n'
+            'time = datetime(2017, 6, 1, 8, 30)\n'
+            'rides = [ride for ride in sim.all_rides\n'
+            '         if ride.start_time <= time <= ride.end_time]\n'
+            'assert rides\n'
+            'view = Map(SCREEN_SIZE)\n'
+            'view.render_objects(rides + list(sim.all_stations.values()),\n'
+            '                    pygame.Surface(SCREEN_SIZE), time)\n'
+            'assert view._motions is None\n'
+            'assert view._ride_pixels(rides, time) == [\n'
+            '    view._latlong_to_screen(ride.get_position(time))\n'
+            '    for ride in rides]\n')
+    subprocess.run([sys.executable, '-c', code], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+###############################################################################
+# Tests for the ride index
+###############################################################################
+def test_ride_index_in_progress():
+    """Test that the ride index finds the same rides in progress, in the
+    same order, as checking every ride, even with a few very long rides.
+    """
+    import random
+    from simulation import RideIndex
+    stations = list(create_stations('stations.json').values())
+    rng = random.Random(5)
+    rides = []
+    for _ in range(2000):
+        start = rng.randrange(0, 1000)
+        end = start + (rng.randrange(0, 600) if rng.random() < 0.01
+                       else rng.randrange(0, 30))
+        rides.append(Ride(stations[0], stations[1],
+                          (from_minutes(start), from_minutes(end)),
+                          (start, end)))
+    index = RideIndex(rides)
+    ordered = sorted(rides, key=lambda ride: ride.start_minute)
+    for time in range(-5, 1700, 3):
+        assert index.in_progress(time) == \
+            [ride for ride in ordered
+             if ride.start_minute < time <= ride.end_minute]
+    assert RideIndex([]).in_progress(0) == []
+
+
+###############################################################################
+# Tests for map caches
+###############################################################################
+def test_map_sprite_cache():
+    """Test that a map loads each sprite only once, and draws the copy
+    scaled for the current zoom level, however the map is panned or zoomed.
+    """
+    from visualizer import SCREEN_SIZE, ZOOM_STEP, Map
+    view = Map(SCREEN_SIZE)
+    screen = pygame.Surface(SCREEN_SIZE)
+    station = next(iter(create_stations('stations.json').values()))
+    loaded = []
+    load_sprite = view._load_sprite
+
+    def counted_load(sprite):
+        loaded.append(sprite)
+        return load_sprite(sprite)
+
+    view._load_sprite = counted_load
+    view.render_objects([station], screen, datetime(2017, 6, 1, 8, 0, 0))
+    sprites = view._sprites[station.sprite]
+    for zoom, pan in [(0, (0, 0)), (3 * ZOOM_STEP, (0, 0)), (0, (-40, -30))]:
+        view.zoom(zoom)
+        view.pan(pan)
+        view.render_objects([station], screen, datetime(2017, 6, 1, 8, 0, 0))
+    assert loaded == [station.sprite]
+    assert view._sprites[station.sprite] is sprites
+    assert view._zoom_level() == 3
+    assert sprites[3].get_width() > sprites[0].get_width()
+
+
+def test_map_view_cache():
+    """Test that a map reuses its scaled view and the pixels of its
+    stations until it is panned or zoomed, and works them out again after.
+    """
+    from visualizer import SCREEN_SIZE, ZOOM_STEP, Map, image_to_bytes
+    view = Map(SCREEN_SIZE)
+    screen = pygame.Surface(SCREEN_SIZE)
+    station = next(iter(create_stations('stations.json').values()))
+    time = datetime(2017, 6, 1, 8, 0, 0)
+
+    first = view.get_current_view()
+    view.render_objects([station], screen, time)
+    assert view.get_current_view() is first
+    pixels = view._pixels[station]
+    assert pixels == view._latlong_to_screen(station.location)
+
+    for change in [lambda: view.zoom(3 * ZOOM_STEP),
+                   lambda: view.pan((-40, -30))]:
+        change()
+        changed = view.get_current_view()
+        assert changed is not first
+        assert changed.get_size() == SCREEN_SIZE
+        assert view.get_current_view() is changed
+        assert image_to_bytes(changed, 'RGB') == \
+            image_to_bytes(view._scale_view(), 'RGB')
+        view.render_objects([station], screen, time)
+        assert view._pixels[station] != pixels
+        assert view._pixels[station] == \
+            view._latlong_to_screen(station.location)
+        first, pixels = changed, view._pixels[station]
+
+
+###############################################################################
+# Tests for PriorityQueue
+###############################################################################
+def test_priority_queue_fifo_ties():
+    """Test that PriorityQueue removes events in order of time, and events
+    with the same time in the order they were added.
+    """
+    early = to_minutes(datetime(2017, 6, 1, 8, 0, 0))
+    late = early + 5
+    events = [Event(None, late), Event(None, early), Event(None, late),
+              Event(None, early)]
+
+    pq = PriorityQueue()
+    for event in events:
+        pq.add(event)
+
+    removed = []
+    while not pq.is_empty():
+        removed.append(pq.remove())
+    assert removed == [events[1], events[3], events[0], events[2]]
+
+
+###############################################################################
+# Tests for HeapPriorityQueue
+###############################################################################
+def test_heap_priority_queue_fifo_ties():
+    """Test that events with the same time are removed in the order they
+    were added, whether they were added one at a time or in bulk.
+    """
+    early = to_minutes(datetime(2017, 6, 1, 8, 0, 0))
+    late = early + 5
+    events = [Event(None, late), Event(None, early), Event(None, late),
+              Event(None, early)]
+
+    pq = HeapPriorityQueue()
+    pq.add_all(events[:2])
+    pq.add(events[2])
+    pq.add(events[3])
+
+    removed = []
+    while not pq.is_empty():
+        removed.append(pq.remove())
+    assert removed == [events[1], events[3], events[0], events[2]]
+
+
+###############################################################################
+# Tests for TimeWheelQueue
+###############################################################################
+def test_time_wheel_matches_heap():
+    """Test that a TimeWheelQueue removes items in the same order as a
+    HeapPriorityQueue, including items beyond its wheel and items added
+    behind it.
+    """
+    import random
+    rng = random.Random(148)
+    wheel = TimeWheelQueue(lambda event: event.time, slots=8)
+    heap = HeapPriorityQueue()
+    start = to_minutes(datetime(2017, 6, 1, 8, 0, 0))
+    for _ in range(300):
+        if heap.is_empty() or rng.random() < 0.6:
+            event = Event(None, start + rng.randrange(40))
+            wheel.add(event)
+            heap.add(event)
+        else:
+            assert wheel.peek() is heap.peek()
+            assert wheel.remove() is heap.remove()
+        assert len(wheel) == len(heap)
+
+
+def test_time_wheel_simulation():
+    """Test that a simulation that keeps its events in a time wheel gives
+    the same results as one that keeps them in a heap.
+    """
+    start = datetime(2017, 6, 1, 8, 0, 0)
+    end = datetime(2017, 6, 1, 9, 30, 0)
+    for discrete in (False, True):
+        results = []
+        for time_wheel in (False, True):
+            sim = Simulation('stations.json', 'sample_rides.csv',
+                             headless=True, time_wheel=time_wheel)
+            results.append((sim.run(start, end, discrete),
+                            sim.get_state(end)))
+        assert results[0] == results[1]
+
+
 if __name__ == '__main__':
     import pytest
     pytest.main(['a1_test_sample.py'])
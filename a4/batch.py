@@ -0,0 +1,98 @@
+"""Bike-share simulation - Batch simulations
+
+This file runs many headless simulations of the same stations and rides over
+different time windows, such as every rush hour in a month.
+
+The stations and rides are read only once. Each worker process receives its
+own copy of them when it starts, and sets up one simulation of them, with its
+ride index, leaderboard and station grid. Before every window, it only puts
+the stations back in the state described in the stations file, and empties
+the event queue and the active rides.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from bikeshare import EPOCH, Ride, Station
+from simulation import Simulation, create_stations, stream_rides
+
+if TYPE_CHECKING:
+    # Only for annotations, so that list-based batches don't need NumPy.
+    from ridetable import RideTable
+
+# The data of the current worker process, set by _start_worker. The keys are
+# 'simulation', 'state' and 'discrete'.
+_WORKER = {}
+
+
+def run_windows(station_file: str, ride_file: str,
+                windows: List[Tuple[datetime, datetime]],
+                columnar: bool = False, discrete: bool = True,
+                max_workers: Optional[int] = None) -> List[Dict[str, object]]:
+    """Run a separate simulation of the given stations and rides for each
+    (start, end) window in <windows>, spread over <max_workers> processes,
+    and return a table of the results.
+
+    Row i of the table is for windows[i]. It has a 'start' and an 'end' key
+    for the window, and the four keys of Simulation.calculate_statistics.
+
+    If <columnar> is True, the rides are kept in a RideTable, which is much
+    faster to send to the workers. <discrete> is passed on to
+    Simulation.run. If <max_workers> is None, one process is used per CPU.
+    """
+    stations = create_stations(station_file)
+    if columnar:
+        from ridetable import load_ride_table
+        rides = load_ride_table(ride_file, stations)
+    else:
+        rides = list(stream_rides(ride_file, stations))
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # Hand out a few windows at a time, but leave enough chunks for every
+    # worker to stay busy until the end.
+    chunksize = max(1, len(windows) // (4 * max_workers))
+    with ProcessPoolExecutor(max_workers, initializer=_start_worker,
+                             initargs=(stations, rides, discrete)) as pool:
+        results = list(pool.map(_run_window, windows, chunksize=chunksize))
+
+    table = []
+    for (start, end), stats in zip(windows, results):
+        row = {'start': start, 'end': end}
+        row.update(stats)
+        table.append(row)
+    return table
+
+
+def _start_worker(stations: Dict[str, Station],
+                  rides: Union[List[Ride], 'RideTable'],
+                  discrete: bool) -> None:
+    """Create the simulation that this worker process runs windows of,
+    and remember the state that every window starts from.
+    """
+    simulation = Simulation.from_data(stations, rides, headless=True)
+    _WORKER['simulation'] = simulation
+    _WORKER['state'] = simulation.get_state(EPOCH)
+    _WORKER['discrete'] = discrete
+
+
+def _run_window(window: Tuple[datetime, datetime]) \
+        -> Dict[str, Tuple[str, float]]:
+    """Simulate this worker's stations and rides over <window>, starting
+    from the original state of the stations, and return the statistics.
+    """
+    simulation = _WORKER['simulation']
+    simulation.set_state(_WORKER['state'])
+    return simulation.run(window[0], window[1], _WORKER['discrete'])
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'concurrent.futures', 'datetime', 'os',
+            'bikeshare', 'ridetable', 'simulation'
+        ]
+    })
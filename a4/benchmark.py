@@ -0,0 +1,398 @@
+"""Bike-share simulation - Benchmarks
+
+This file contains benchmarks for the slow parts of the bike-share
+simulation. Each benchmark returns its measurements in a dictionary, so that
+the results can be compared between versions of the code.
+
+It also contains a suite that times the main parts of a simulation on
+generated workloads of increasing size; see workload.py.
+
+Usage:
+    python benchmark.py
+        print the results of bench_ride_loading
+    python benchmark.py <results file> [<largest number of rides>]
+        run the suite on every scale in SCALES, up to the given number of
+        rides, and save the results to the JSON file <results file>
+    python benchmark.py memory [<number of rides>]
+        print the results of bench_memory
+    python benchmark.py queues [<number of events>]
+        print the results of bench_event_queues
+"""
+import csv
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Callable, Dict, List, Tuple, Union
+
+from bikeshare import STATS, Ride, Station, to_minutes
+from container import HeapPriorityQueue, PriorityQueue, TimeWheelQueue
+from dataset import compile_dataset, open_dataset
+from ridetable import RideTable
+from simulation import (DATETIME_FORMAT, RideEndEvent, RideStartEvent,
+                        Simulation, create_rides, create_stations,
+                        stream_rides, _event_minute)
+from workload import FIRST_DAY, generate_rides, generate_stations
+
+# The (number of stations, number of rides) of each scale in the suite.
+SCALES = [(100, 10000), (1000, 100000), (1000, 1000000),
+          (10000, 10000000), (10000, 50000000)]
+# The most rides that bench_scale loads as a list of Ride objects.
+LIST_RIDES = 1000000
+
+
+def best_time(function: Callable[[], object], repeat: int) -> float:
+    """Return the shortest time, in seconds, that <function> took to run in
+    <repeat> calls.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def write_repeated_rides(rides_file: str, out_file: str, copies: int) -> int:
+    """Write <copies> copies of the rides in <rides_file> to <out_file>, and
+    return the number of rides written.
+
+    Each copy is moved one day later than the one before it, so that the
+    file has as many distinct timestamps as a real export of that length.
+    """
+    with open(rides_file) as file:
+        rides = list(csv.reader(file))
+
+    with open(out_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for day in range(copies):
+            shift = timedelta(days=day)
+            for line in rides:
+                start = datetime.strptime(line[0], DATETIME_FORMAT) + shift
+                end = datetime.strptime(line[2], DATETIME_FORMAT) + shift
+                writer.writerow([start.strftime(DATETIME_FORMAT), line[1],
+                                 end.strftime(DATETIME_FORMAT)] + line[3:])
+    return copies * len(rides)
+
+
+def bench_ride_loading(stations_file: str, rides_file: str,
+                       copies: int = 10000,
+                       repeat: int = 3) -> Dict[str, float]:
+    """Return the parse throughput, in rides per second, of create_rides and
+    stream_rides on <copies> copies of the rides in <rides_file>.
+    """
+    stations = create_stations(stations_file)
+    with tempfile.TemporaryDirectory() as folder:
+        big_file = os.path.join(folder, 'rides.csv')
+        num_rides = write_repeated_rides(rides_file, big_file, copies)
+
+        create_time = best_time(
+            lambda: create_rides(big_file, stations), repeat)
+        stream_time = best_time(
+            lambda: list(stream_rides(big_file, stations)), repeat)
+
+    return {
+        'rides': num_rides,
+        'create_rides per second': num_rides / create_time,
+        'stream_rides per second': num_rides / stream_time,
+        'speedup': create_time / stream_time
+    }
+
+
+def bench_scale(num_stations: int, num_rides: int, seed: int = 0,
+                repeat: int = 3, minutes: int = 3,
+                queue_events: int = 1000) -> Dict[str, float]:
+    """Return timings of the main parts of a simulation of a workload with
+    <num_stations> stations and <num_rides> rides, generated with <seed>.
+
+    Workloads of up to LIST_RIDES rides are loaded into a list of Ride
+    objects with create_rides. Larger ones would not fit in memory that way,
+    so they are compiled into a dataset file and opened as a memory-mapped
+    RideTable instead; see dataset.py.
+
+    Every timing is for the morning rush hour of the first day, when the
+    most rides are active:
+    - _update_active_rides is timed for <minutes> minutes, since every call
+      scans all of the rides; it only works on a list, so it is left out,
+      as None, for a RideTable
+    - _update_active_rides_fast is timed for the whole hour
+    - PriorityQueue and HeapPriorityQueue are timed adding, then removing,
+      the start events of the first <queue_events> rides of the hour, in
+      random order; PriorityQueue scans its list to insert each event
+    - calculate_statistics is timed once the hour has been simulated
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        stations_file = os.path.join(folder, 'stations.json')
+        rides_file = os.path.join(folder, 'rides.csv')
+        generate_stations(stations_file, num_stations, seed)
+        days = generate_rides(stations_file, rides_file, num_rides, seed)
+        started = time.perf_counter()
+        if num_rides <= LIST_RIDES:
+            loader = 'create_rides'
+            stations = create_stations(stations_file)
+            rides = create_rides(rides_file, stations)
+        else:
+            loader = 'compile_dataset'
+            # The dataset file is memory-mapped, so it is only removed
+            # once the rides are no longer needed.
+            dataset_file = os.path.join(folder, 'rides.bikes')
+            compile_dataset(stations_file, rides_file, dataset_file)
+            stations, rides = open_dataset(dataset_file)
+        load_time = time.perf_counter() - started
+        results = {
+            'stations': num_stations,
+            'rides': num_rides,
+            'days': days,
+            'loaded with': loader,
+            'rides loaded per second': num_rides / load_time
+        }
+        results.update(_bench_rush_hour(stations, rides, seed, repeat,
+                                        minutes, queue_events))
+        del rides
+    return results
+
+
+def _bench_rush_hour(stations: Dict[str, Station],
+                     rides: Union[List[Ride], RideTable], seed: int,
+                     repeat: int, minutes: int,
+                     queue_events: int) -> Dict[str, float]:
+    """Return the rush hour timings of bench_scale for <stations> and
+    <rides>.
+    """
+    num_bikes = {station_id: station.num_bikes
+                 for station_id, station in stations.items()}
+    start = to_minutes(FIRST_DAY) + 8 * 60
+    end = start + 60
+
+    scan_time = None
+    if isinstance(rides, list):
+        sim = _fresh_simulation(stations, num_bikes, rides)
+        started = time.perf_counter()
+        for minute in range(minutes):
+            sim._update_active_rides(start + minute)
+        scan_time = (time.perf_counter() - started) / minutes
+
+    sim = _fresh_simulation(stations, num_bikes, rides)
+    sim._load_events(start, end, sim._rides_in_progress(start))
+    num_events = len(sim.event_priority)
+    started = time.perf_counter()
+    for minute in range(61):
+        sim._update_active_rides_fast(start + minute)
+    fast_time = (time.perf_counter() - started) / 61
+
+    events = [RideStartEvent(sim, ride.start_minute, ride)
+              for ride, _ in zip(sim._rides_starting(start, end),
+                                 range(queue_events))]
+    random.Random(seed).shuffle(events)
+    queue_times = {name: best_time(lambda queue=queue: _fill_and_empty(
+        queue(), events), repeat) for name, queue in
+                   [('PriorityQueue', PriorityQueue),
+                    ('HeapPriorityQueue', HeapPriorityQueue)]}
+
+    stats_time = best_time(sim.calculate_statistics, repeat)
+    scan_stats_time = best_time(
+        lambda: [sim.concise_stats(sim.all_stations, stat)
+                 for stat in STATS], repeat)
+
+    return {
+        '_update_active_rides seconds per minute': scan_time,
+        '_update_active_rides_fast seconds per minute': fast_time,
+        'rush hour events': num_events,
+        'queue events': len(events),
+        'PriorityQueue operations per second':
+            2 * len(events) / queue_times['PriorityQueue'],
+        'HeapPriorityQueue operations per second':
+            2 * len(events) / queue_times['HeapPriorityQueue'],
+        'calculate_statistics seconds': stats_time,
+        'full scan statistics seconds': scan_stats_time
+    }
+
+
+def bench_memory(num_stations: int = 1000, num_rides: int = 200000,
+                 seed: int = 0) -> Dict[str, float]:
+    """Return the memory, in bytes per million rides, taken by the Ride
+    objects of a workload with <num_stations> stations and <num_rides>
+    rides, generated with <seed>, and by a start event for each of them.
+
+    Each is measured both for Ride and RideStartEvent and, as a baseline,
+    for copies of them that keep their attributes in a dictionary instead
+    of in __slots__; see unslotted.
+
+    The rides are read with stream_rides, as a simulation reads them. The
+    memory is measured with tracemalloc, and includes the times of the
+    rides, but not the list that holds them.
+    """
+    dict_ride, dict_event = unslotted(Ride), unslotted(RideStartEvent)
+    with tempfile.TemporaryDirectory() as folder:
+        stations_file = os.path.join(folder, 'stations.json')
+        rides_file = os.path.join(folder, 'rides.csv')
+        generate_stations(stations_file, num_stations, seed)
+        generate_rides(stations_file, rides_file, num_rides, seed)
+        stations = create_stations(stations_file)
+
+        tracemalloc.start()
+        rides = list(stream_rides(rides_file, stations))
+        ride_bytes = tracemalloc.get_traced_memory()[0] - \
+            sys.getsizeof(rides)
+        tracemalloc.stop()
+
+        # Each Ride is dropped as soon as it is copied, so only the copies
+        # and their own times are left.
+        tracemalloc.start()
+        dict_rides = [dict_ride(ride.start, ride.end,
+                                (ride.start_time, ride.end_time),
+                                (ride.start_minute, ride.end_minute))
+                      for ride in stream_rides(rides_file, stations)]
+        dict_ride_bytes = tracemalloc.get_traced_memory()[0] - \
+            sys.getsizeof(dict_rides)
+        tracemalloc.stop()
+        del dict_rides
+
+    sim = Simulation.from_data(stations, rides, headless=True)
+    tracemalloc.start()
+    events = [RideStartEvent(sim, ride.start_minute, ride) for ride in rides]
+    event_bytes = tracemalloc.get_traced_memory()[0] - sys.getsizeof(events)
+    tracemalloc.stop()
+    del events
+
+    tracemalloc.start()
+    events = [dict_event(sim, ride.start_minute, ride) for ride in rides]
+    dict_event_bytes = tracemalloc.get_traced_memory()[0] - \
+        sys.getsizeof(events)
+    tracemalloc.stop()
+
+    scale = 1000000 / len(rides)
+    return {
+        'stations': num_stations,
+        'rides': len(rides),
+        'Ride bytes per million rides': ride_bytes * scale,
+        'unslotted Ride bytes per million rides': dict_ride_bytes * scale,
+        'RideStartEvent bytes per million rides': event_bytes * scale,
+        'unslotted RideStartEvent bytes per million rides':
+            dict_event_bytes * scale
+    }
+
+
+def unslotted(cls: type) -> type:
+    """Return a class with the same methods as <cls>, but whose instances
+    keep their attributes in a dictionary, as they would if neither <cls>
+    nor its base classes declared __slots__.
+
+    A subclass without __slots__ would not do: its instances get a
+    dictionary, but still keep the attributes in the slots of <cls>.
+    """
+    namespace = {}
+    for base in reversed(cls.__mro__[:-1]):
+        namespace.update(
+            (name, value) for name, value in vars(base).items()
+            if name not in ('__slots__', '__dict__', '__weakref__')
+            and not isinstance(value, types.MemberDescriptorType))
+    return type('Unslotted' + cls.__name__, (), namespace)
+
+
+def bench_event_queues(num_events: int = 1000000, holds: int = 200000,
+                       seed: int = 0,
+                       list_adds: int = 5) -> Dict[str, float]:
+    """Return the speed of each kind of event queue holding <num_events>
+    pending ride end events, spread over 30 days.
+
+    HeapPriorityQueue and TimeWheelQueue are timed adding all the events one
+    at a time, then for <holds> hold operations, each of which removes the
+    next event and adds one that ends a random ride duration later, as a
+    simulation does, and then removing every event.
+
+    PriorityQueue scans its list to insert each event, which would take
+    hours at this size, so it is only timed for <list_adds> adds to a queue
+    that already holds the events.
+    """
+    rng = random.Random(seed)
+    first = to_minutes(FIRST_DAY)
+    minutes = [rng.randrange(30 * 24 * 60) for _ in range(num_events)]
+    durations = [min(180, max(1, int(rng.lognormvariate(2.5, 0.6))))
+                 for _ in range(holds)]
+    events = [RideEndEvent(None, first + minute, None) for minute in minutes]
+
+    results = {'events': num_events, 'holds': holds}
+    for name, queue in [('HeapPriorityQueue', HeapPriorityQueue()),
+                        ('TimeWheelQueue', TimeWheelQueue(_event_minute))]:
+        started = time.perf_counter()
+        for event in events:
+            queue.add(event)
+        filled = time.perf_counter()
+        for duration in durations:
+            event = queue.remove()
+            queue.add(RideEndEvent(None, event.time + duration, None))
+        held = time.perf_counter()
+        while not queue.is_empty():
+            queue.remove()
+        drained = time.perf_counter()
+        results[name + ' adds per second'] = num_events / (filled - started)
+        results[name + ' holds per second'] = holds / (held - filled)
+        results[name + ' removes per second'] = num_events / (drained - held)
+
+    queue = PriorityQueue()
+    queue._queue = sorted(events, reverse=True)
+    results['PriorityQueue adds per second'] = list_adds / sum(
+        best_time(lambda event=event: queue.add(event), 1)
+        for event in events[:list_adds])
+    return results
+
+
+def run_suite(results_file: str,
+              scales: List[Tuple[int, int]] = SCALES,
+              seed: int = 0) -> List[Dict[str, float]]:
+    """Run bench_scale on each (number of stations, number of rides) in
+    <scales>, save the results to <results_file> as a JSON list with one
+    object per scale, and return them.
+
+    The file is rewritten after each scale, so the results of the smaller
+    scales are kept even if a larger one runs out of memory.
+    """
+    results = []
+    for num_stations, num_rides in scales:
+        results.append(bench_scale(num_stations, num_rides, seed))
+        with open(results_file, 'w') as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+def _fresh_simulation(stations: Dict[str, Station],
+                      num_bikes: Dict[str, int],
+                      rides: List[Ride]) -> Simulation:
+    """Return a new headless simulation of <stations> and <rides>, after
+    giving each station its number of bikes in <num_bikes>.
+    """
+    for station_id, station in stations.items():
+        station.reset(num_bikes[station_id])
+    return Simulation.from_data(stations, rides, headless=True)
+
+
+def _fill_and_empty(queue: PriorityQueue, events: List[RideStartEvent]) \
+        -> None:
+    """Add all of <events> to <queue>, one at a time, then remove them.
+    """
+    for event in events:
+        queue.add(event)
+    while not queue.is_empty():
+        queue.remove()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'queues':
+        print(bench_event_queues(int(sys.argv[2]) if len(sys.argv) > 2
+                                 else 1000000))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'memory':
+        print(bench_memory(num_rides=int(sys.argv[2]) if len(sys.argv) > 2
+                           else 200000))
+    elif len(sys.argv) > 1:
+        largest = int(sys.argv[2]) if len(sys.argv) > 2 else SCALES[-1][1]
+        for row in run_suite(sys.argv[1], [scale for scale in SCALES
+                                           if scale[1] <= largest]):
+            print(row)
+    else:
+        print(bench_ride_loading('stations.json', 'sample_rides.csv'))
@@ -14,22 +14,102 @@ objects in this simulation.
 There is also an abstract Drawable class that is the superclass for both
 Station and Ride. It enables the simulation to visualize these objects in
 a graphical window.
+
+A StatView lets a station's statistics be read and changed by name.
+
+Finally, the StationGrid class indexes stations by location, to find the
+stations in an area or near a point quickly.
 """
-from datetime import datetime
-from typing import Tuple
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+import math
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Only for annotations: leaderboard imports this module.
+    from leaderboard import Leaderboard
 
 # Sprite files
 STATION_SPRITE = 'stationsprite.png'
 RIDE_SPRITE = 'bikesprite.png'
 
+# The moment from which times are counted when they are stored as numbers.
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+# The statistics that each station keeps track of, and the index of each one
+# in Station.counts.
+STATS = ['starting rides', 'ending rides', 'low availability',
+         'low unoccupied']
+STARTING_RIDES, ENDING_RIDES, LOW_AVAILABILITY, LOW_UNOCCUPIED = range(4)
+
+# The length of one degree of latitude, in metres.
+METRES_PER_DEGREE = 111320
+
+
+def to_minutes(time: datetime) -> int:
+    """Return the number of whole minutes from EPOCH to <time>.
+
+    >>> to_minutes(datetime(1970, 1, 2, 0, 1))
+    1441
+    """
+    return (time - EPOCH) // MINUTE
+
+
+def from_minutes(minutes: int) -> datetime:
+    """Return the time that is <minutes> minutes after EPOCH.
+
+    >>> from_minutes(1441)
+    datetime.datetime(1970, 1, 2, 0, 1)
+    """
+    return EPOCH + timedelta(minutes=int(minutes))
+
+
+def parse_datetime(text: str) -> datetime:
+    """Return the datetime described by <text>, which is in the format of
+    the ride data, '%Y-%m-%d %H:%M'.
+
+    This gives the same result as datetime.strptime(text, '%Y-%m-%d %H:%M'),
+    but is much faster because it doesn't need to interpret the format.
+
+    >>> parse_datetime('2017-06-01 08:00')
+    datetime.datetime(2017, 6, 1, 8, 0)
+    >>> parse_datetime('2017-6-1 8:05')
+    datetime.datetime(2017, 6, 1, 8, 5)
+    """
+    date, clock = text.split(' ')
+    year, month, day = date.split('-')
+    hour, minute = clock.split(':')
+    return datetime(int(year), int(month), int(day), int(hour), int(minute))
+
+
+def distance(first: Tuple[float, float],
+             second: Tuple[float, float]) -> float:
+    """Return the distance, in metres, between two (long, lat) locations.
+
+    The earth is treated as flat around the two locations, which is accurate
+    to a fraction of a percent over the size of a city.
+
+    >>> round(distance((-73.57, 45.51), (-73.57, 45.52)))
+    1113
+    """
+    mean_lat = math.radians((first[1] + second[1]) / 2)
+    dx = (first[0] - second[0]) * math.cos(mean_lat)
+    dy = first[1] - second[1]
+    return math.hypot(dx, dy) * METRES_PER_DEGREE
+
 
 class Drawable:
     """A base class for objects that the graphical renderer can be drawn.
 
+    Drawables, and their subclasses, declare their attributes in
+    __slots__, so that their instances don't each need a dictionary.
+
     === Public Attributes ===
     sprite:
         The filename of the image to be drawn for this object.
     """
+    __slots__ = ('sprite',)
     sprite: str
 
     def __init__(self, sprite_file: str) -> None:
@@ -57,21 +137,37 @@ class Station(Drawable):
         name of the station
     num_bikes: int
         current number of bikes at the station
-    stats: dict
-        A dictionary that will keep track of all the statistics to display for
-        the current Station
+    counts: list
+        The value of each statistic to display for the current Station, in
+        the order of STATS. Use record to change it.
+    stats: StatView
+        A mapping from each statistic in STATS to its value in counts.
+        Setting a value changes counts, through record.
     unocc_spots: int
         An integer which keeps track of the unoccupied spots at the Station
 
+    === Private Attributes ===
+    _interval_start:
+        The time, in minutes since EPOCH, from which low availability and
+        low unoccupied time has not yet been credited to stats, or None if
+        time is being credited one minute at a time instead.
+    _leaderboard:
+        The Leaderboard that ranks this station, or None.
+
     === Representation Invariants ===
     - 0 <= num_bikes <= capacity
+    - len(counts) == len(STATS)
     """
+    __slots__ = ('name', 'location', 'capacity', 'num_bikes', 'counts',
+                 'unocc_spots', '_interval_start', '_leaderboard')
     name: str
     location: Tuple[float, float]
     capacity: int
     num_bikes: int
-    stats: dict
+    counts: List[int]
     unocc_spots: int
+    _interval_start: Optional[int]
+    _leaderboard: Optional['Leaderboard']
 
     def __init__(self, pos: Tuple[float, float], cap: int,
                  num_bikes: int, name: str) -> None:
@@ -82,11 +178,43 @@ class Station(Drawable):
         Drawable.__init__(self, STATION_SPRITE)
         self.location = pos
         self.capacity = cap
-        self.num_bikes = num_bikes
         self.name = name
-        self.unocc_spots = self.capacity - self.num_bikes
-        self.stats = {'starting rides': 0, 'ending rides': 0, 'low availability'
-        : 0, 'low unoccupied': 0}
+        self._leaderboard = None
+        self.reset(num_bikes)
+
+    def reset(self, num_bikes: int) -> None:
+        """Put this station back in the state it was in when it was created
+        with <num_bikes> bikes, with all of its statistics at zero.
+
+        Precondition: 0 <= num_bikes <= self.capacity
+        """
+        self.num_bikes = num_bikes
+        self.unocc_spots = self.capacity - num_bikes
+        self.counts = [0] * len(STATS)
+        self._interval_start = None
+        if self._leaderboard is not None:
+            for stat in range(len(STATS)):
+                self._leaderboard.update(self, stat)
+
+    @property
+    def stats(self) -> 'StatView':
+        """Return a mapping from each statistic in STATS to its value.
+        """
+        return StatView(self)
+
+    def set_leaderboard(self, leaderboard: Optional['Leaderboard']) -> None:
+        """Report every future change to this station's statistics to
+        <leaderboard>, or to no leaderboard if it is None.
+        """
+        self._leaderboard = leaderboard
+
+    def record(self, stat: int, amount: int) -> None:
+        """Add <amount> to this station's statistic at index <stat> of
+        STATS, such as STARTING_RIDES.
+        """
+        self.counts[stat] += amount
+        if self._leaderboard is not None:
+            self._leaderboard.update(self, stat)
 
     def get_position(self, time: datetime) -> Tuple[float, float]:
         """Return the (long, lat) position of this station for the given time.
@@ -103,7 +231,7 @@ class Station(Drawable):
         had less than or equal to 5 bikes.
         """
         if self.num_bikes <= 5:
-            self.stats['low availability'] += 60
+            self.record(LOW_AVAILABILITY, 60)
 
     def low_unoccupied(self):
         """
@@ -111,7 +239,94 @@ class Station(Drawable):
         less than or equal to 5 unoccupied spots
         """
         if self.unocc_spots <= 5:
-            self.stats['low unoccupied'] += 60
+            self.record(LOW_UNOCCUPIED, 60)
+
+    def begin_interval(self, time: Optional[int]) -> None:
+        """Start crediting low availability and low unoccupied time to this
+        station from <time>, in minutes since EPOCH, onwards.
+
+        Passing None stops interval crediting, so that credit_interval has no
+        effect until the next call to this method.
+        """
+        self._interval_start = time
+
+    def credit_interval(self, time: int) -> None:
+        """Credit the time, in seconds, between the start of the current
+        interval and <time>, in minutes since EPOCH, to the low availability
+        and low unoccupied statistics, then start a new interval at <time>.
+
+        The station's state must not have changed during the interval, so this
+        must be called right *before* num_bikes or unocc_spots is updated.
+        No time is credited if <time> is before the start of the interval.
+        """
+        if self._interval_start is None:
+            return
+        elapsed = max(time - self._interval_start, 0) * 60
+        if self.num_bikes <= 5 and elapsed:
+            self.record(LOW_AVAILABILITY, elapsed)
+        if self.unocc_spots <= 5 and elapsed:
+            self.record(LOW_UNOCCUPIED, elapsed)
+        self._interval_start = time
+
+
+class StatView(MutableMapping):
+    """A view of a station's statistics by name, like a dictionary whose
+    keys are STATS.
+
+    The values are read from the station's counts, and setting one goes
+    through Station.record, so that the station's leaderboard stays up to
+    date. Statistics can't be added or removed.
+
+    >>> station = Station((0.0, 0.0), 10, 5, 'A')
+    >>> station.stats['starting rides'] += 2
+    >>> station.counts
+    [2, 0, 0, 0]
+    >>> station.stats == {'starting rides': 2, 'ending rides': 0,
+    ...                   'low availability': 0, 'low unoccupied': 0}
+    True
+
+    === Private Attributes ===
+    _station:
+        The station whose statistics this is a view of.
+    """
+    __slots__ = ('_station',)
+    _station: Station
+
+    def __init__(self, station: Station) -> None:
+        """Initialize a view of the statistics of <station>.
+        """
+        self._station = station
+
+    def __getitem__(self, stat: str) -> int:
+        """Return the value of <stat>.
+        """
+        return self._station.counts[STATS.index(stat)]
+
+    def __setitem__(self, stat: str, value: int) -> None:
+        """Change the value of <stat> to <value>.
+        """
+        index = STATS.index(stat)
+        self._station.record(index, value - self._station.counts[index])
+
+    def __delitem__(self, stat: str) -> None:
+        """Raise a TypeError, since statistics can't be removed.
+        """
+        raise TypeError('station statistics can not be removed')
+
+    def __iter__(self) -> Iterator[str]:
+        """Return an iterator over the names of the statistics.
+        """
+        return iter(STATS)
+
+    def __len__(self) -> int:
+        """Return the number of statistics.
+        """
+        return len(STATS)
+
+    def __repr__(self) -> str:
+        """Return a representation of this view, like a dictionary's.
+        """
+        return repr(dict(self))
 
 
 class Ride(Drawable):
@@ -126,22 +341,66 @@ class Ride(Drawable):
         the time this ride starts
     end_time:
         the time this ride ends
+    start_minute:
+        start_time, in minutes since EPOCH
+    end_minute:
+        end_time, in minutes since EPOCH
+    motion:
+        the (long, lat) of the start station, the (long, lat) distance
+        travelled per second, and the start time in seconds since EPOCH,
+        in that order. This is worked out once, so that positions can be
+        calculated quickly for many rides at once.
+
+    === Private Attributes ===
+    _motion:
+        motion, or None if it hasn't been needed yet. Most rides are never
+        drawn, so they never need it.
 
     === Representation Invariants ===
     - start_time < end_time
+    - start_time and end_time are whole minutes
     """
+    __slots__ = ('start', 'end', 'start_time', 'end_time', 'start_minute',
+                 'end_minute', '_motion')
     start: Station
     end: Station
     start_time: datetime
     end_time: datetime
+    start_minute: int
+    end_minute: int
+    _motion: Optional[Tuple[float, float, float, float, float]]
 
     def __init__(self, start: Station, end: Station,
-                 times: Tuple[datetime, datetime]) -> None:
+                 times: Tuple[datetime, datetime],
+                 minutes: Optional[Tuple[int, int]] = None) -> None:
         """Initialize a ride object with the given start and end information.
+
+        <minutes> are the start and end times in minutes since EPOCH, if the
+        caller already has them; otherwise, they are worked out from <times>.
         """
         Drawable.__init__(self, RIDE_SPRITE)
         self.start, self.end = start, end
         self.start_time, self.end_time = times[0], times[1]
+        if minutes is None:
+            minutes = (to_minutes(times[0]), to_minutes(times[1]))
+        self.start_minute, self.end_minute = minutes[0], minutes[1]
+        self._motion = None
+
+    @property
+    def motion(self) -> Tuple[float, float, float, float, float]:
+        """Return the motion of this ride, working it out the first time.
+        """
+        if self._motion is None:
+            start, end = self.start.location, self.end.location
+            total_time = (self.end_time - self.start_time).total_seconds()
+            if total_time > 0:
+                speed_x = (end[0] - start[0]) / total_time
+                speed_y = (end[1] - start[1]) / total_time
+            else:
+                speed_x = speed_y = 0.0
+            self._motion = (start[0], start[1], speed_x, speed_y,
+                            (self.start_time - EPOCH).total_seconds())
+        return self._motion
 
     def get_position(self, time: datetime) -> Tuple[float, float]:
         """Return the (long, lat) position of this ride for the given time.
@@ -153,28 +412,138 @@ class Ride(Drawable):
         - start_time < time < end_time
         """
 
-        total_time = self.end_time - self.start_time
-        total_time = total_time.total_seconds()
-
         elapsed_time = time - self.start_time
         elapsed_time = elapsed_time.total_seconds()
 
-        calculate_x = self.start.location[0] + ((elapsed_time / total_time) *
-                                                (self.end.location[0] -
-                                                 self.start.location[0]))
-
-        calculate_y = self.start.location[1] + ((elapsed_time / total_time) *
-                                                (self.end.location[1] -
-                                                    self.start.location[1]))
+        motion = self.motion
+        calculate_x = motion[0] + elapsed_time * motion[2]
+        calculate_y = motion[1] + elapsed_time * motion[3]
         return (calculate_x, calculate_y)
 
+
+class StationGrid:
+    """A spatial index of stations, for finding the stations in an area.
+
+    The stations are sorted into the square cells of a uniform grid over
+    (long, lat) coordinates, so that a query only looks at the stations in
+    the cells that overlap the area it asks about.
+
+    === Attributes ===
+    cell_size:
+        the width and height of each cell, in degrees
+
+    === Private Attributes ===
+    _cells:
+        maps the (column, row) of each cell that holds at least one station
+        to the stations in that cell
+    _size:
+        the number of stations in this grid
+
+    === Representation Invariants ===
+    - every station is in the cell that contains its location
+    """
+    cell_size: float
+    _cells: dict
+    _size: int
+
+    def __init__(self, stations: Iterable[Station],
+                 cell_size: float = 0.005) -> None:
+        """Initialize a grid of <stations>, with cells <cell_size> degrees
+        wide and high.
+        """
+        self.cell_size = cell_size
+        self._cells = {}
+        self._size = 0
+        for station in stations:
+            self._cells.setdefault(self._cell(station.location),
+                                   []).append(station)
+            self._size += 1
+
+    def __len__(self) -> int:
+        """Return the number of stations in this grid.
+        """
+        return self._size
+
+    def _cell(self, location: Tuple[float, float]) -> Tuple[int, int]:
+        """Return the (column, row) of the cell that contains <location>.
+        """
+        return (math.floor(location[0] / self.cell_size),
+                math.floor(location[1] / self.cell_size))
+
+    def in_box(self, min_corner: Tuple[float, float],
+               max_corner: Tuple[float, float]) -> List[Station]:
+        """Return the stations whose location is in the box with the given
+        (long, lat) corners, edges included, in no particular order.
+        """
+        min_col, min_row = self._cell(min_corner)
+        max_col, max_row = self._cell(max_corner)
+        if (max_col - min_col + 1) * (max_row - min_row + 1) > \
+                len(self._cells):
+            # The box covers more cells than hold stations.
+            cells = list(self._cells.values())
+        else:
+            cells = [self._cells[(col, row)]
+                     for col in range(min_col, max_col + 1)
+                     for row in range(min_row, max_row + 1)
+                     if (col, row) in self._cells]
+        return [station for cell in cells for station in cell
+                if min_corner[0] <= station.location[0] <= max_corner[0] and
+                min_corner[1] <= station.location[1] <= max_corner[1]]
+
+    def within(self, location: Tuple[float, float],
+               radius: float) -> List[Station]:
+        """Return the stations at most <radius> metres from the (long, lat)
+        <location>, from nearest to farthest, breaking ties by name.
+        """
+        lat_span = radius / METRES_PER_DEGREE
+        # A degree of longitude is shortest at the latitude farthest from the
+        # equator that a station in range can have.
+        shortest = math.cos(math.radians(min(abs(location[1]) + lat_span,
+                                             90)))
+        long_span = lat_span / shortest if shortest > 0 else 360
+        candidates = self.in_box(
+            (location[0] - long_span, location[1] - lat_span),
+            (location[0] + long_span, location[1] + lat_span))
+        return [station for station in _by_distance(location, candidates)
+                if distance(location, station.location) <= radius]
+
+    def nearest(self, location: Tuple[float, float],
+                k: int) -> List[Station]:
+        """Return the <k> stations nearest to the (long, lat) <location>,
+        from nearest to farthest, breaking ties by name. If there are fewer
+        than <k> stations, return all of them.
+
+        The stations within a small radius are found first, and the radius
+        doubles until at least <k> stations are within it.
+        """
+        if k >= self._size:
+            return _by_distance(location, [station
+                                           for cell in self._cells.values()
+                                           for station in cell])
+        radius = self.cell_size * METRES_PER_DEGREE
+        found = self.within(location, radius)
+        while len(found) < k:
+            radius *= 2
+            found = self.within(location, radius)
+        return found[:k]
+
+
+def _by_distance(location: Tuple[float, float],
+                 stations: List[Station]) -> List[Station]:
+    """Return <stations> sorted from nearest to farthest from <location>,
+    breaking ties by name.
+    """
+    return sorted(stations, key=lambda station: (
+        distance(location, station.location), station.name))
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'datetime'
+            'collections', 'datetime', 'math'
         ],
         'max-attributes': 15
     })
@@ -8,12 +8,17 @@ University of Toronto
 
 === Module Description ===
 
-This module contains the Container and PriorityQueue classes.
+This module contains the Container and PriorityQueue classes, as well as
+HeapPriorityQueue, a binary-heap priority queue with the same FIFO tie-breaking
+that the simulation uses for its events, and TimeWheelQueue, which keeps items
+with whole-number priorities, such as minutes, in one bucket per priority.
 
 Your only task here is to implement the add method for PriorityQueue,
 according to its docstring.
 """
-from typing import Generic, List, TypeVar
+from collections import deque
+import heapq
+from typing import Callable, Deque, Generic, Iterable, List, Tuple, TypeVar
 from datetime import datetime, timedelta
 # Ignore this line; it is only used to facilitate PyCharm's typechecking.
 T = TypeVar('T')
@@ -91,20 +96,12 @@ class PriorityQueue(Container[T]):
         >>> pq.remove()
         'X'
         """
-        self._queue.append(item)
-        sorted(self._queue, reverse=True)
-    #
-    # def add(self, item: T) -> None:
-    #     """Add <item> to this PriorityQueue.
-    #
-    #     NOTE: See the docstring for the 'remove' method for a sample doctest.
-    #     """
-    #     if self._queue == []:
-    #         self._queue.append(item)
-    #     else:
-    #         for i in range(len(self._queue)):
-    #             if self._queue[i] < item:
-    #                 self._queue.insert(i + 1, item)
+        # <item> goes after every item it is smaller than, and before every
+        # item equal to it, so that those are removed first.
+        i = 0
+        while i < len(self._queue) and item < self._queue[i]:
+            i += 1
+        self._queue.insert(i, item)
 
     def remove(self) -> T:
         """Remove and return the next item from this PriorityQueue.
@@ -140,12 +137,360 @@ class PriorityQueue(Container[T]):
         return not self._queue
 
 
+class _HeapEntry(Generic[T]):
+    """An item stored in a HeapPriorityQueue, tagged with its insertion order.
+
+    === Attributes ===
+    item:
+        the item that was added to the queue
+    order:
+        the number of items added to the queue before this one
+    """
+    __slots__ = ['item', 'order']
+    item: T
+    order: int
+
+    def __init__(self, item: T, order: int) -> None:
+        """Initialize a new entry for <item>."""
+        self.item = item
+        self.order = order
+
+    def __lt__(self, other: '_HeapEntry') -> bool:
+        """Return whether this entry should be removed before <other>.
+
+        Items are compared with '<' only; an item that is neither smaller nor
+        larger than the other is a tie, which goes to the earlier insertion.
+        """
+        if self.item < other.item:
+            return True
+        if other.item < self.item:
+            return False
+        return self.order < other.order
+
+
+class HeapPriorityQueue(Container[T]):
+    """A queue of items that operates in FIFO-priority order, stored as a heap.
+
+    This behaves exactly like PriorityQueue: the item with the smallest
+    priority is removed first, and ties are resolved in first-in-first-out
+    order. Adding or removing an item takes O(log n) time, and add_all
+    loads many items at once in O(n) time.
+
+    === Private Attributes ===
+    _heap:
+      A binary min-heap of entries, ordered by item and then insertion order.
+    _count:
+      The total number of items that have ever been added to this queue.
+
+    === Representation Invariants ===
+    - all items in _heap are of the same type
+    - _heap satisfies the heap invariant of the heapq module
+    - every entry in _heap has a distinct order, which is less than _count
+    """
+    _heap: List[_HeapEntry[T]]
+    _count: int
+
+    def __init__(self) -> None:
+        """Initialize this to an empty HeapPriorityQueue.
+        """
+        self._heap = []
+        self._count = 0
+
+    def add(self, item: T) -> None:
+        """Add <item> to this HeapPriorityQueue.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.add("Shardul")
+        >>> pq.add("Sam")
+        >>> pq.add("Apple")
+        >>> pq.remove()
+        'Apple'
+        >>> pq.remove()
+        'Sam'
+        """
+        heapq.heappush(self._heap, _HeapEntry(item, self._count))
+        self._count += 1
+
+    def add_all(self, items: Iterable[T]) -> None:
+        """Add every item in <items> to this HeapPriorityQueue.
+
+        Items that tie are removed in the order they appear in <items>.
+        This takes time linear in the final size of the queue, which is
+        much faster than adding the items one at a time.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.add('fred')
+        >>> pq.add_all(['monalisa', 'arju', 'hat'])
+        >>> [pq.remove() for _ in range(4)]
+        ['arju', 'fred', 'hat', 'monalisa']
+        """
+        for item in items:
+            self._heap.append(_HeapEntry(item, self._count))
+            self._count += 1
+        heapq.heapify(self._heap)
+
+    def remove(self) -> T:
+        """Remove and return the next item from this HeapPriorityQueue.
+
+        Precondition: this priority queue is non-empty.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.add('fred')
+        >>> pq.add('arju')
+        >>> pq.add('monalisa')
+        >>> pq.add('hat')
+        >>> pq.remove()
+        'arju'
+        >>> pq.remove()
+        'fred'
+        >>> pq.remove()
+        'hat'
+        >>> pq.remove()
+        'monalisa'
+        """
+        return heapq.heappop(self._heap).item
+
+    def peek(self) -> T:
+        """Return the next item from this HeapPriorityQueue without removing
+        it.
+
+        Precondition: this priority queue is non-empty.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.add('fred')
+        >>> pq.add('arju')
+        >>> pq.peek()
+        'arju'
+        >>> pq.is_empty()
+        False
+        """
+        return self._heap[0].item
+
+    def is_empty(self) -> bool:
+        """Return True iff this HeapPriorityQueue is empty.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.is_empty()
+        True
+        >>> pq.add('fred')
+        >>> pq.is_empty()
+        False
+        """
+        return not self._heap
+
+    def __len__(self) -> int:
+        """Return the number of items in this HeapPriorityQueue.
+
+        >>> pq = HeapPriorityQueue()
+        >>> pq.add_all(['fred', 'arju'])
+        >>> len(pq)
+        2
+        """
+        return len(self._heap)
+
+
+class TimeWheelQueue(Container[T]):
+    """A queue of items that operates in FIFO-priority order, where each
+    item's priority is a whole number, such as the minute of an event.
+
+    This behaves like HeapPriorityQueue, as long as items with the same key
+    are ties and items with different keys compare like their keys. Items
+    whose keys are close to the smallest key are kept in a timing wheel: a
+    ring of buckets, one per key, each a FIFO queue. Items whose keys are
+    too far ahead for the wheel wait in a heap until the wheel gets to them.
+
+    Adding an item takes O(1) time, unless it is too far ahead for the wheel.
+    Removing one takes O(1) time, plus the time to step over any empty
+    buckets, which is at most one step for every key passed over.
+
+    The wheel only moves forwards. An item whose key is smaller than the
+    key of the last item that peek or remove returned can still be added,
+    but then every item is moved, which takes O(n) time.
+
+    === Private Attributes ===
+    _key:
+      Returns the key of an item.
+    _wheel:
+      The buckets. The bucket for key k is _wheel[k % len(_wheel)].
+    _now:
+      The smallest key that the wheel currently holds a bucket for; the
+      wheel holds the keys from _now to _now + len(_wheel) - 1.
+    _in_wheel:
+      The number of items in the buckets of the wheel.
+    _overflow:
+      A heap of (key, insertion order, item) for the items whose keys are
+      too large for the wheel.
+    _count:
+      The total number of items that have ever been added to _overflow.
+
+    === Representation Invariants ===
+    - every item in the bucket for key k has key k, and _now <= k
+    - every key in _overflow is at least _now + len(_wheel)
+    - the items of each bucket are in the order they were added
+    """
+    _key: Callable[[T], int]
+    _wheel: List[Deque[T]]
+    _now: int
+    _in_wheel: int
+    _overflow: List[Tuple[int, int, T]]
+    _count: int
+
+    def __init__(self, key: Callable[[T], int], slots: int = 1024) -> None:
+        """Initialize this to an empty TimeWheelQueue of items whose keys
+        are given by <key>, with a wheel of <slots> buckets.
+
+        Precondition: slots > 0
+        """
+        self._key = key
+        self._wheel = [deque() for _ in range(slots)]
+        self._now = 0
+        self._in_wheel = 0
+        self._overflow = []
+        self._count = 0
+
+    def add(self, item: T) -> None:
+        """Add <item> to this TimeWheelQueue.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0])
+        >>> pq.add((5, 'Shardul'))
+        >>> pq.add((3, 'Sam'))
+        >>> pq.add((5, 'Apple'))
+        >>> pq.remove()
+        (3, 'Sam')
+        >>> pq.remove()
+        (5, 'Shardul')
+        """
+        key = self._key(item)
+        if key < self._now:
+            if self.is_empty():
+                self._now = key
+            else:
+                self._rewind(key)
+        if key < self._now + len(self._wheel):
+            self._wheel[key % len(self._wheel)].append(item)
+            self._in_wheel += 1
+        else:
+            heapq.heappush(self._overflow, (key, self._count, item))
+            self._count += 1
+
+    def add_all(self, items: Iterable[T]) -> None:
+        """Add every item in <items> to this TimeWheelQueue.
+
+        Items that tie are removed in the order they appear in <items>.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0])
+        >>> pq.add((4, 'fred'))
+        >>> pq.add_all([(7, 'monalisa'), (2, 'arju'), (4, 'hat')])
+        >>> [pq.remove()[1] for _ in range(4)]
+        ['arju', 'fred', 'hat', 'monalisa']
+        """
+        for item in items:
+            self.add(item)
+
+    def remove(self) -> T:
+        """Remove and return the next item from this TimeWheelQueue.
+
+        Precondition: this priority queue is non-empty.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0], slots=4)
+        >>> pq.add_all([(9, 'fred'), (1, 'arju'), (30, 'monalisa')])
+        >>> pq.add((9, 'hat'))
+        >>> [pq.remove()[1] for _ in range(4)]
+        ['arju', 'fred', 'hat', 'monalisa']
+        """
+        self._find_next()
+        self._in_wheel -= 1
+        return self._wheel[self._now % len(self._wheel)].popleft()
+
+    def peek(self) -> T:
+        """Return the next item from this TimeWheelQueue without removing
+        it.
+
+        Precondition: this priority queue is non-empty.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0])
+        >>> pq.add((4, 'fred'))
+        >>> pq.add((2, 'arju'))
+        >>> pq.peek()
+        (2, 'arju')
+        >>> pq.is_empty()
+        False
+        """
+        self._find_next()
+        return self._wheel[self._now % len(self._wheel)][0]
+
+    def is_empty(self) -> bool:
+        """Return True iff this TimeWheelQueue is empty.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0])
+        >>> pq.is_empty()
+        True
+        >>> pq.add((4, 'fred'))
+        >>> pq.is_empty()
+        False
+        """
+        return not self._in_wheel and not self._overflow
+
+    def __len__(self) -> int:
+        """Return the number of items in this TimeWheelQueue.
+
+        >>> pq = TimeWheelQueue(lambda item: item[0])
+        >>> pq.add_all([(4, 'fred'), (2000, 'arju')])
+        >>> len(pq)
+        2
+        """
+        return self._in_wheel + len(self._overflow)
+
+    def _find_next(self) -> None:
+        """Move the wheel forwards until _now is the key of the next item.
+
+        If the wheel is empty, it jumps straight to the first key in
+        _overflow.
+
+        Precondition: this priority queue is non-empty.
+        """
+        wheel = self._wheel
+        while not wheel[self._now % len(wheel)]:
+            if self._in_wheel:
+                self._now += 1
+            else:
+                self._now = self._overflow[0][0]
+            self._fill_from_overflow()
+
+    def _fill_from_overflow(self) -> None:
+        """Move the items in _overflow whose keys are now in the wheel into
+        their buckets.
+        """
+        limit = self._now + len(self._wheel)
+        while self._overflow and self._overflow[0][0] < limit:
+            key, _, item = heapq.heappop(self._overflow)
+            self._wheel[key % len(self._wheel)].append(item)
+            self._in_wheel += 1
+
+    def _rewind(self, key: int) -> None:
+        """Move the wheel back so that it starts at <key>, moving every item
+        to its new place.
+
+        Precondition: key < _now
+        """
+        items = []
+        for offset in range(len(self._wheel)):
+            bucket = self._wheel[(self._now + offset) % len(self._wheel)]
+            items.extend(bucket)
+            bucket.clear()
+        while self._overflow:
+            items.append(heapq.heappop(self._overflow)[2])
+        self._now = key
+        self._in_wheel = 0
+        self.add_all(items)
+
+
 if __name__ == '__main__':
     # import doctest
     # doctest.testmod()
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'doctest', 'python_ta', 'typing'
+            'doctest', 'python_ta', 'typing', 'collections', 'heapq'
         ],
     })
@@ -0,0 +1,137 @@
+"""Bike-share simulation - Compiled datasets
+
+This file converts a stations JSON file and a rides CSV file into a single
+binary dataset file, and opens such files again.
+
+A dataset file holds the station table, the ride columns of a RideTable
+sorted by start time, and a time index giving the first ride that starts in
+each minute. The columns are memory-mapped rather than read, so opening a
+dataset takes milliseconds no matter how many rides it holds, and processes
+that open the same dataset share its pages.
+
+File layout:
+    - MAGIC (8 bytes)
+    - the length of the header, as a little-endian unsigned 64-bit integer
+    - the header: a JSON object describing the stations and where each
+      column is stored in the file
+    - the columns, as little-endian integers, starting at the first
+      multiple of ALIGNMENT bytes after the header, and each aligned to
+      ALIGNMENT bytes; the header records each column's offset from the
+      start of the first column
+
+Usage: python dataset.py <stations file> <rides file> <dataset file>
+"""
+import json
+import struct
+import sys
+from typing import BinaryIO, Dict, Tuple
+import numpy as np
+
+from bikeshare import Station
+from ridetable import RideTable, load_ride_table
+from simulation import create_stations
+
+MAGIC = b'BIKESHR1'
+ALIGNMENT = 64
+# The columns of a dataset file, in the order they are written. They are
+# little-endian whatever the byte order of the machine, so that a dataset
+# can be opened on any machine.
+COLUMNS = [('start_time', '<i8'), ('end_time', '<i8'),
+           ('start_station', '<i4'), ('end_station', '<i4'),
+           ('minute_index', '<i8')]
+
+
+def compile_dataset(stations_file: str, rides_file: str,
+                    dataset_file: str) -> None:
+    """Write the stations in <stations_file> and the rides in <rides_file>
+    to a new dataset file called <dataset_file>.
+
+    Rides that start in the same minute keep the order they have in
+    <rides_file>.
+    """
+    stations = create_stations(stations_file)
+    table = load_ride_table(rides_file, stations).sorted_by_start()
+    first_minute, minute_index = table.minute_index()
+    columns = {'start_time': table.start_time,
+               'end_time': table.end_time,
+               'start_station': table.start_station,
+               'end_station': table.end_station,
+               'minute_index': minute_index}
+
+    header = {
+        'stations': [[station_id, station.name, station.location[0],
+                      station.location[1], station.capacity,
+                      station.num_bikes]
+                     for station_id, station in stations.items()],
+        'first_minute': first_minute,
+        'columns': {}
+    }
+    offset = 0
+    for name, dtype in COLUMNS:
+        header['columns'][name] = [offset, len(columns[name])]
+        offset = _align(offset + len(columns[name]) * np.dtype(dtype).itemsize)
+
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(encoded))
+    with open(dataset_file, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<Q', len(encoded)))
+        file.write(encoded)
+        for name, dtype in COLUMNS:
+            _write_at(file, data_start + header['columns'][name][0],
+                      columns[name].astype(dtype).tobytes())
+
+
+def open_dataset(dataset_file: str) -> Tuple[Dict[str, Station], RideTable]:
+    """Return the stations and the rides stored in <dataset_file>.
+
+    The stations are new Station objects in the state they were in when the
+    dataset was compiled. The rides are in a RideTable whose columns are
+    memory-mapped from the file, sorted by start time.
+    """
+    with open(dataset_file, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(dataset_file + ' is not a dataset file')
+        header_length = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    data_start = _align(len(MAGIC) + 8 + header_length)
+
+    stations = {}
+    for station_id, name, long, lat, capacity, num_bikes in \
+            header['stations']:
+        stations[station_id] = Station((long, lat), capacity, num_bikes, name)
+
+    columns = {}
+    for name, dtype in COLUMNS:
+        offset, length = header['columns'][name]
+        if length == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(dataset_file, dtype=dtype, mode='r',
+                                      offset=data_start + offset,
+                                      shape=(length,))
+
+    table = RideTable(list(stations.values()), columns['start_time'],
+                      columns['end_time'], columns['start_station'],
+                      columns['end_station'])
+    table.set_minute_index(header['first_minute'], columns['minute_index'])
+    return stations, table
+
+
+def _align(offset: int) -> int:
+    """Return the smallest multiple of ALIGNMENT that is at least <offset>.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _write_at(file: BinaryIO, offset: int, data: bytes) -> None:
+    """Write <data> to <file> at <offset>, padding with zero bytes.
+
+    Precondition: <file> is positioned at or before <offset>.
+    """
+    file.write(bytes(offset - file.tell()))
+    file.write(data)
+
+
+if __name__ == '__main__':
+    compile_dataset(sys.argv[1], sys.argv[2], sys.argv[3])
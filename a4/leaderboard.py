@@ -0,0 +1,160 @@
+"""Bike-share simulation - Station leaderboards
+
+This file contains the Leaderboard class, which ranks stations by each of
+their statistics while a simulation runs. Finding the leading station takes
+constant time, so the statistics can be polled as often as needed.
+"""
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bikeshare import STATS, Station
+
+
+class Leaderboard:
+    """Rankings of stations by each of their statistics.
+
+    A station ranks above another for a statistic if its value is larger, or
+    if the values are equal and its name is smaller when compared with '<'.
+
+    For each statistic, the stations are kept in an indexed binary heap with
+    the highest ranked station at the root. A station must call update
+    whenever one of its statistics changes; see Station.record.
+
+    Internally, a statistic is given by its index in Station.counts, so that
+    no statistic names are hashed while a simulation runs.
+
+    === Private Attributes ===
+    _indices:
+        Maps the name of each statistic to its index in Station.counts.
+    _heaps:
+        For the statistic at each index, a list of stations that forms a
+        binary heap for that statistic, or None if it isn't ranked.
+    _positions:
+        For the statistic at each index, a dictionary from each station to
+        its index in the heap for that statistic, or None if it isn't
+        ranked.
+
+    === Representation Invariants ===
+    - for every statistic and every index i > 0 of its heap, the station at
+      index i does not rank above the station at index (i - 1) // 2
+    - _positions[stat][station] is the index of station in _heaps[stat]
+    """
+    _indices: Dict[str, int]
+    _heaps: List[Optional[List[Station]]]
+    _positions: List[Optional[Dict[Station, int]]]
+
+    def __init__(self, stations: Iterable[Station], stats: Iterable[str]) \
+            -> None:
+        """Initialize rankings of <stations> by each statistic in <stats>,
+        and have the stations report their changes to this leaderboard.
+
+        Precondition: every statistic in <stats> is in STATS.
+        """
+        stations = list(stations)
+        self._indices = {stat: STATS.index(stat) for stat in stats}
+        self._heaps = [None] * len(STATS)
+        self._positions = [None] * len(STATS)
+        for stat in self._indices.values():
+            # A list sorted by rank is already a valid heap.
+            heap = sorted(stations, key=lambda s, key=stat: (-s.counts[key],
+                                                              s.name))
+            self._heaps[stat] = heap
+            self._positions[stat] = {station: i
+                                     for i, station in enumerate(heap)}
+        for station in stations:
+            station.set_leaderboard(self)
+
+    def update(self, station: Station, stat: int) -> None:
+        """Move <station> to its new place in the ranking for the statistic
+        at index <stat> of STATS, after its value has changed.
+        """
+        if self._heaps[stat] is None:
+            return
+        index = self._sift_up(stat, self._positions[stat][station])
+        self._sift_down(stat, index)
+
+    def leader(self, stat: str) -> Tuple[Optional[str], float]:
+        """Return the name and value of the highest ranked station for <stat>.
+
+        If there are no stations, return (None, -1).
+        """
+        stat = self._indices[stat]
+        heap = self._heaps[stat]
+        if not heap:
+            return None, -1
+        return heap[0].name, heap[0].counts[stat]
+
+    def top_k(self, stat: str, k: int) -> List[Tuple[str, float]]:
+        """Return the names and values of the <k> highest ranked stations for
+        <stat>, from highest to lowest.
+
+        This takes O(k log k) time, by only exploring the part of the heap
+        that holds the top <k> stations.
+        """
+        stat = self._indices[stat]
+        heap = self._heaps[stat]
+        result = []
+        frontier = [(-heap[0].counts[stat], heap[0].name, 0)] if heap else []
+        while frontier and len(result) < k:
+            _, _, index = heapq.heappop(frontier)
+            result.append((heap[index].name, heap[index].counts[stat]))
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (-heap[child].counts[stat],
+                                              heap[child].name, child))
+        return result
+
+    def _ranks_above(self, stat: int, first: Station,
+                     second: Station) -> bool:
+        """Return whether <first> ranks above <second> for <stat>.
+        """
+        if first.counts[stat] != second.counts[stat]:
+            return first.counts[stat] > second.counts[stat]
+        return first.name < second.name
+
+    def _swap(self, stat: int, i: int, j: int) -> None:
+        """Swap the stations at indexes <i> and <j> of the heap for <stat>.
+        """
+        heap, positions = self._heaps[stat], self._positions[stat]
+        heap[i], heap[j] = heap[j], heap[i]
+        positions[heap[i]] = i
+        positions[heap[j]] = j
+
+    def _sift_up(self, stat: int, index: int) -> int:
+        """Move the station at <index> of the heap for <stat> up until it
+        doesn't rank above its parent, and return its new index.
+        """
+        heap = self._heaps[stat]
+        while index > 0:
+            parent = (index - 1) // 2
+            if not self._ranks_above(stat, heap[index], heap[parent]):
+                break
+            self._swap(stat, index, parent)
+            index = parent
+        return index
+
+    def _sift_down(self, stat: int, index: int) -> None:
+        """Move the station at <index> of the heap for <stat> down until no
+        child ranks above it.
+        """
+        heap = self._heaps[stat]
+        while True:
+            best = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap) and \
+                        self._ranks_above(stat, heap[child], heap[best]):
+                    best = child
+            if best == index:
+                return
+            self._swap(stat, index, best)
+            index = best
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing', 'heapq',
+            'bikeshare'
+        ]
+    })
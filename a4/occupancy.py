@@ -0,0 +1,309 @@
+"""Bike-share simulation - Station occupancy history
+
+This file contains the OccupancyRecorder class, which records the number of
+bikes and unoccupied spots of every station over the course of simulation
+runs, and the function to load a recording saved to a file.
+
+Only changes are recorded: a station that keeps the same number of bikes for
+a whole day takes no space for that day. Each change takes 12 bytes, in
+NumPy arrays that are allocated ahead of time and doubled in size when they
+fill up, rather than one Python object per station per minute.
+
+Like a Profiler, a recorder is attached to one simulation and replaces some
+of its methods with recording versions on that simulation object only, so
+recording costs nothing when it is not used.
+
+File layout:
+    - MAGIC (8 bytes)
+    - the length of the header, as a little-endian unsigned 64-bit integer
+    - the header: a JSON object with the station ids and the number of
+      changes
+    - the columns, as little-endian integers in the order of COLUMNS, one
+      after the other, with the changes grouped by station and in order of
+      time within each station
+"""
+from datetime import datetime
+import json
+import struct
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import numpy as np
+
+from bikeshare import Ride, Station, from_minutes, to_minutes
+
+if TYPE_CHECKING:
+    # Only for annotations: simulation imports this module.
+    from simulation import Simulation
+
+MAGIC = b'BIKEOCC1'
+# The columns of a recording. A change is one row: the time it happened, in
+# minutes since EPOCH, the index of its station, and the station's number of
+# bikes and unoccupied spots from then on. They are little-endian whatever
+# the byte order of the machine, like the columns of a dataset.
+COLUMNS = [('time', '<i4'), ('station', '<i4'),
+           ('num_bikes', '<i2'), ('unocc_spots', '<i2')]
+
+
+class OccupancyRecorder:
+    """A record of the changes to the number of bikes and unoccupied spots
+    of a set of stations.
+
+    A station's state at a given minute is its state after every event in
+    that minute, so a station has at most one change per minute, and the
+    states in between are not kept.
+
+    === Attributes ===
+    station_ids:
+        The ids of the recorded stations. In the columns, each station is
+        given by its index in this list.
+
+    === Private Attributes ===
+    _columns:
+        Maps each column in COLUMNS to an array whose first _size entries
+        hold the recorded changes, in the order they were recorded. The rest
+        of each array is space for later changes.
+    _size:
+        The number of recorded changes.
+    _ids:
+        Maps each station id to its index in station_ids.
+    _stations:
+        Maps each Station of the attached simulation to its index in
+        station_ids.
+    _last:
+        For each station index, the row, time, number of bikes and number
+        of unoccupied spots of the latest change to that station, or None if
+        it has none.
+    _order:
+        The rows of the changes sorted by station, and by time within each
+        station, or None if they haven't been sorted since the last change.
+    _bounds:
+        The changes of station i are at _order[_bounds[i]:_bounds[i + 1]],
+        or None if _order is None.
+    _times:
+        The times of the rows in _order, or None if _order is None.
+
+    === Representation Invariants ===
+    - all arrays in _columns have the same length, which is at least _size
+    - the changes of each station are recorded in order of time, and no two
+      of them have the same time
+    """
+    station_ids: List[str]
+    _columns: Dict[str, np.ndarray]
+    _size: int
+    _ids: Dict[str, int]
+    _stations: Dict[Station, int]
+    _last: List[Optional[Tuple[int, int, int, int]]]
+    _order: Optional[np.ndarray]
+    _bounds: Optional[np.ndarray]
+    _times: Optional[np.ndarray]
+
+    def __init__(self, station_ids: List[str], capacity: int = 4096) -> None:
+        """Initialize an empty recorder for the stations with <station_ids>,
+        with room for <capacity> changes before it has to grow.
+        """
+        self.station_ids = list(station_ids)
+        self._columns = {name: np.empty(max(capacity, 1), dtype=dtype)
+                         for name, dtype in COLUMNS}
+        self._size = 0
+        self._ids = {station_id: i
+                     for i, station_id in enumerate(self.station_ids)}
+        self._stations = {}
+        self._last = [None] * len(self.station_ids)
+        self._order = None
+        self._bounds = None
+        self._times = None
+
+    def __len__(self) -> int:
+        """Return the number of changes recorded.
+        """
+        return self._size
+
+    def attach(self, simulation: 'Simulation') -> None:
+        """Record the state of every station of <simulation> at the start of
+        each of its runs from now on, and every change to it during the run.
+
+        Precondition: the stations of <simulation> have the ids in
+                      station_ids, and its runs go forwards in time.
+        """
+        self._stations = {station: self._ids[station_id] for station_id,
+                          station in simulation.all_stations.items()}
+        advance = simulation._advance
+        give = simulation.update_giving_station
+        take = simulation.update_taking_station
+
+        def recorded_advance(start: int, *args, **kwargs) -> None:
+            for station in simulation.all_stations.values():
+                self.record(station, start)
+            advance(start, *args, **kwargs)
+
+        def recorded_give(ride: Ride, time: int) -> None:
+            give(ride, time)
+            self.record(ride.start, time)
+
+        def recorded_take(ride: Ride, time: int) -> None:
+            take(ride, time)
+            self.record(ride.end, time)
+
+        simulation._advance = recorded_advance
+        simulation.update_giving_station = recorded_give
+        simulation.update_taking_station = recorded_take
+
+    def record(self, station: Station, minute: int) -> None:
+        """Record the current state of <station> as its state at <minute>,
+        in minutes since EPOCH, if it has changed since the last time it was
+        recorded.
+
+        Precondition: <station> belongs to the attached simulation, and
+                      <minute> is no earlier than the last time <station>
+                      was recorded.
+        """
+        i = self._stations[station]
+        last = self._last[i]
+        if last is not None and last[2] == station.num_bikes and \
+                last[3] == station.unocc_spots:
+            return
+        if last is not None and last[1] == minute:
+            # Only the state at the end of each minute is kept.
+            row = last[0]
+        else:
+            if self._size == len(self._columns['time']):
+                self._grow()
+            row = self._size
+            self._size += 1
+        self._columns['time'][row] = minute
+        self._columns['station'][row] = i
+        self._columns['num_bikes'][row] = station.num_bikes
+        self._columns['unocc_spots'][row] = station.unocc_spots
+        self._last[i] = (row, minute, station.num_bikes, station.unocc_spots)
+        self._order = None
+
+    def occupancy(self, station_id: str, time: datetime) -> Tuple[int, int]:
+        """Return the number of bikes and unoccupied spots at the station
+        with <station_id> at <time>.
+
+        The station's latest change at or before <time> is found by binary
+        search. Raise a ValueError if it has none.
+        """
+        rows, times = self._changes(station_id)
+        k = int(np.searchsorted(times, to_minutes(time), side='right')) - 1
+        if k < 0:
+            raise ValueError('no occupancy of station {} is recorded at {}'
+                             .format(station_id, time))
+        return (int(self._columns['num_bikes'][rows[k]]),
+                int(self._columns['unocc_spots'][rows[k]]))
+
+    def extremes(self, station_id: str, start: datetime, end: datetime,
+                 column: str = 'num_bikes') -> Tuple[int, int]:
+        """Return the smallest and largest value of <column>, either
+        'num_bikes' or 'unocc_spots', at the station with <station_id> from
+        <start> to <end>, inclusive.
+
+        The changes in that time are found by binary search. Raise a
+        ValueError if the station has no change at or before <start>.
+
+        Precondition: start <= end
+        """
+        rows, times = self._changes(station_id)
+        first = int(np.searchsorted(times, to_minutes(start),
+                                    side='right')) - 1
+        if first < 0:
+            raise ValueError('no occupancy of station {} is recorded at {}'
+                             .format(station_id, start))
+        last = int(np.searchsorted(times, to_minutes(end), side='right'))
+        values = self._columns[column][rows[first:last]]
+        return int(values.min()), int(values.max())
+
+    def history(self, station_id: str) -> List[Tuple[datetime, int, int]]:
+        """Return the time, number of bikes and number of unoccupied spots of
+        every change to the station with <station_id>, in order of time.
+        """
+        rows, _ = self._changes(station_id)
+        return [(from_minutes(int(self._columns['time'][row])),
+                 int(self._columns['num_bikes'][row]),
+                 int(self._columns['unocc_spots'][row])) for row in rows]
+
+    def save(self, occupancy_file: str) -> None:
+        """Save the changes recorded so far to <occupancy_file>, in the
+        layout described at the top of this module.
+        """
+        self._changes(None)
+        header = json.dumps({'stations': self.station_ids,
+                             'changes': self._size}).encode('utf-8')
+        with open(occupancy_file, 'wb') as file:
+            file.write(MAGIC)
+            file.write(struct.pack('<Q', len(header)))
+            file.write(header)
+            for name, _ in COLUMNS:
+                file.write(self._columns[name][self._order].tobytes())
+
+    def _changes(self, station_id: Optional[str]) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows of the changes to the station with <station_id>,
+        and their times, both in order of time.
+
+        The changes of all stations are sorted once, the first time they are
+        needed after a change is recorded. If <station_id> is None, only
+        sort them, and return empty arrays.
+        """
+        if self._order is None:
+            stations = self._columns['station'][:self._size]
+            self._order = np.argsort(stations, kind='stable')
+            self._bounds = np.searchsorted(
+                stations[self._order], np.arange(len(self.station_ids) + 1))
+            self._times = self._columns['time'][self._order]
+        if station_id is None:
+            return self._order[:0], self._times[:0]
+        i = self._ids[station_id]
+        first, last = self._bounds[i], self._bounds[i + 1]
+        return self._order[first:last], self._times[first:last]
+
+    def _grow(self) -> None:
+        """Double the room for changes in each column.
+        """
+        for name, dtype in COLUMNS:
+            column = np.empty(2 * len(self._columns[name]), dtype=dtype)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+
+
+def load_occupancy(occupancy_file: str) -> OccupancyRecorder:
+    """Return a recorder with the changes saved in <occupancy_file> by
+    OccupancyRecorder.save.
+
+    It can be queried right away, and attached to a simulation of the same
+    stations to record more changes after the saved ones.
+    """
+    with open(occupancy_file, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(occupancy_file + ' is not an occupancy file')
+        header_length = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(header_length).decode('utf-8'))
+        columns = {name: np.fromfile(file, dtype=dtype,
+                                     count=header['changes'])
+                   for name, dtype in COLUMNS}
+
+    recorder = OccupancyRecorder(header['stations'], header['changes'])
+    for name, _ in COLUMNS:
+        recorder._columns[name][:header['changes']] = columns[name]
+    recorder._size = header['changes']
+    # The saved changes are grouped by station, so each station's latest
+    # change is the last of its group.
+    recorder._changes(None)
+    for i in range(len(recorder.station_ids)):
+        if recorder._bounds[i + 1] > recorder._bounds[i]:
+            row = int(recorder._bounds[i + 1]) - 1
+            recorder._last[i] = (row, int(columns['time'][row]),
+                                 int(columns['num_bikes'][row]),
+                                 int(columns['unocc_spots'][row]))
+    return recorder
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['save', 'load_occupancy'],
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'datetime', 'json', 'struct', 'numpy',
+            'bikeshare'
+        ]
+    })
@@ -0,0 +1,254 @@
+"""Bike-share simulation - Partitioned simulations
+
+This file runs one long simulation as many shorter ones in parallel, by
+splitting its time into partitions, such as days, and giving each partition
+to its own process.
+
+A partition can't know the state of the stations at its start until the
+partition before it has finished. So each partition starts from a guess,
+made by a quick pass over the rides that only moves bikes between stations
+and leaves out everything to do with statistics. Once all partitions are
+done, each one's start state is checked against the end state of the one
+before it. Only the partitions whose start was wrong are run again, all at
+once, each from the end state of the one before it, until every start
+matches. Since the statistics of a partition only depend on its start
+state, they then add up to exactly those of a single sequential run.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import heapq
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from bikeshare import STATS, Ride, Station, from_minutes, to_minutes
+from simulation import RideEndEvent, Simulation
+
+if TYPE_CHECKING:
+    # Only for annotations, so that list-based runs don't need NumPy.
+    from ridetable import RideTable
+
+# The simulation of the current worker process, and whether it runs in
+# discrete mode, set by _start_worker.
+_WORKER = {}
+
+
+def run_partitioned(simulation: Simulation, start: datetime, end: datetime,
+                    discrete: bool = True,
+                    length: timedelta = timedelta(days=1),
+                    max_workers: Optional[int] = None) \
+        -> Tuple[Dict[str, Tuple[str, float]], int]:
+    """Run <simulation> from <start> to <end>, in partitions of <length>
+    spread over <max_workers> processes, and return its statistics and the
+    number of partitions that had to be run again.
+
+    Afterwards, <simulation> is in the same state as if it had been run with
+    simulation.run(start, end, discrete): its stations have the same number
+    of bikes and the same statistics, and the same rides are active.
+
+    <simulation> must be headless. If <max_workers> is None, one process is
+    used per CPU.
+
+    Precondition: <start>, <end> and <length> are whole minutes, and
+                  start < end
+    """
+    boundaries = [start]
+    while boundaries[-1] + length < end:
+        boundaries.append(boundaries[-1] + length)
+    boundaries.append(end)
+
+    # The first partition starts from the real state, with the rides in
+    # progress at <start> active, as in Simulation.run, and the rest from
+    # guesses with no statistics of their own.
+    station_ids = {station: station_id for station_id, station
+                   in simulation.all_stations.items()}
+    first = simulation.get_state(start)
+    first['active rides'] += [
+        _ride_key(ride, station_ids)
+        for ride in simulation._rides_in_progress(to_minutes(start))]
+    states = [first] + _guess_states(simulation, boundaries)
+    tasks = [(states[i], to_minutes(boundaries[i + 1]),
+              i == len(states) - 1) for i in range(len(states))]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers, initializer=_start_worker,
+                             initargs=(simulation.all_stations,
+                                       simulation.all_rides,
+                                       discrete)) as pool:
+        results = list(pool.map(_run_partition, tasks))
+        reruns = 0
+        # Partitions before <done> are known to be right.
+        done = 1
+        while True:
+            while done < len(tasks) and \
+                    _same_state(tasks[done][0], results[done - 1]):
+                done += 1
+            if done == len(tasks):
+                break
+            # Run every partition whose start doesn't match the end of the
+            # partition before it again, from that end. The first of them
+            # now starts from the right state, and so becomes right too.
+            redo = [i for i in range(done, len(tasks))
+                    if not _same_state(tasks[i][0], results[i - 1])]
+            for i in redo:
+                tasks[i] = (_handoff(results[i - 1]),) + tasks[i][1:]
+            for i, result in zip(redo, pool.map(_run_partition,
+                                                [tasks[i] for i in redo])):
+                results[i] = result
+            reruns += len(redo)
+
+    final = results[-1]
+    for station_id, (_, _, stats) in final['stations'].items():
+        for result in results[:-1]:
+            for i, value in enumerate(result['stations'][station_id][2]):
+                stats[i] += value
+    # As after a sequential run, the rides still active at <end> are
+    # waiting for their end events, so that a later run docks them.
+    _, active_rides = simulation.set_state(final)
+    for ride in active_rides:
+        simulation.active_rides[ride] = None
+    simulation.event_priority.add_all(
+        RideEndEvent(simulation, ride.end_minute, ride)
+        for ride in active_rides)
+    simulation._last_minute = to_minutes(end)
+    return simulation.calculate_statistics(), reruns
+
+
+def _guess_states(simulation: Simulation,
+                  boundaries: List[datetime]) -> List[Dict[str, object]]:
+    """Return a guess of the state of <simulation> at each of <boundaries>
+    but the first, in the form returned by Simulation.get_state, if it were
+    run from boundaries[0]. All statistics are zero.
+
+    The guess comes from a quick pass over the rides that only moves bikes,
+    using the simulation's rules: a ride only starts if its station has a
+    bike, it only returns its bike if its end station has a free spot, and
+    at any given time, rides start before they end. Since this pass doesn't
+    credit any statistics, it is much faster than the simulation. The rides
+    are read one at a time, in order of start time, rather than all at once.
+    """
+    start = boundaries[0]
+    station_ids = {station: station_id for station_id, station
+                   in simulation.all_stations.items()}
+    bikes = {station: station.num_bikes
+             for station in simulation.all_stations.values()}
+    # The active rides, in the order they started, and a heap of their
+    # (end time, start order, ride), to find the next one to end.
+    active = {}
+    ends = []
+    for ride in simulation._rides_in_progress(to_minutes(start)):
+        active[ride] = None
+        heapq.heappush(ends, (ride.end_minute, len(ends), ride))
+    order = len(ends)
+    starts = simulation._rides_starting(to_minutes(start),
+                                        to_minutes(boundaries[-1]))
+    # The next ride to start, or None if there are no more.
+    ride = next(starts, None)
+
+    states = []
+    for boundary in boundaries[1:-1]:
+        minute = to_minutes(boundary)
+        while True:
+            time = min(ride.start_minute if ride is not None else minute,
+                       ends[0][0] if ends else minute)
+            if time >= minute:
+                break
+            while ride is not None and ride.start_minute == time:
+                if bikes[ride.start] > 0:
+                    bikes[ride.start] -= 1
+                    active[ride] = None
+                    heapq.heappush(ends, (ride.end_minute, order, ride))
+                    order += 1
+                ride = next(starts, None)
+            while ends and ends[0][0] == time:
+                ended = heapq.heappop(ends)[2]
+                if bikes[ended.end] < ended.end.capacity:
+                    bikes[ended.end] += 1
+                del active[ended]
+        states.append({
+            'time': minute,
+            'stations': {station_ids[station]: _station_state(station,
+                                                              num_bikes)
+                         for station, num_bikes in bikes.items()},
+            'active rides': [_ride_key(ride, station_ids) for ride in active]
+        })
+    return states
+
+
+def _station_state(station: Station, num_bikes: int) \
+        -> Tuple[int, int, List[int]]:
+    """Return the state of <station> with <num_bikes> bikes and no
+    statistics, in the form used by Simulation.get_state.
+    """
+    return num_bikes, station.capacity - num_bikes, [0] * len(STATS)
+
+
+def _ride_key(ride: Ride, station_ids: Dict[Station, str]) \
+        -> Tuple[str, str, int, int]:
+    """Return <ride> in the form used by Simulation.get_state for active
+    rides.
+    """
+    return (station_ids[ride.start], station_ids[ride.end],
+            ride.start_minute, ride.end_minute)
+
+
+def _same_state(first: Dict[str, object], second: Dict[str, object]) -> bool:
+    """Return whether the two states have the same number of bikes and
+    unoccupied spots at every station, and the same active rides in the same
+    order. Their statistics are not compared.
+    """
+    return first['active rides'] == second['active rides'] and \
+        all(first['stations'][station_id][:2] == state[:2]
+            for station_id, state in second['stations'].items())
+
+
+def _handoff(state: Dict[str, object]) -> Dict[str, object]:
+    """Return <state> with all of its statistics set to zero, to start the
+    next partition from.
+    """
+    return {
+        'time': state['time'],
+        'stations': {station_id: (num_bikes, unocc_spots, [0] * len(STATS))
+                     for station_id, (num_bikes, unocc_spots, _)
+                     in state['stations'].items()},
+        'active rides': list(state['active rides'])
+    }
+
+
+def _start_worker(stations: Dict[str, Station],
+                  rides: Union[List[Ride], 'RideTable'],
+                  discrete: bool) -> None:
+    """Create the simulation that this worker process runs partitions of.
+    """
+    _WORKER['simulation'] = Simulation.from_data(stations, rides,
+                                                 headless=True)
+    _WORKER['discrete'] = discrete
+
+
+def _run_partition(task: Tuple[Dict[str, object], int, bool]) \
+        -> Dict[str, object]:
+    """Run this worker's simulation for one partition, and return its state
+    at the end of the partition.
+
+    <task> is the state to start from, the minute the partition ends, and
+    whether it is the last partition. Every partition but the last stops
+    just before the events at its end, which belong to the next partition.
+    """
+    state, end_minute, last = task
+    simulation = _WORKER['simulation']
+    start, active_rides = simulation.set_state(state)
+    simulation._load_events(start, end_minute, active_rides)
+    simulation._advance(start, end_minute, _WORKER['discrete'], None, 60,
+                        last)
+    return simulation.get_state(from_minutes(end_minute))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'concurrent.futures', 'datetime', 'heapq', 'os',
+            'bikeshare', 'simulation'
+        ]
+    })
@@ -0,0 +1,187 @@
+"""Bike-share simulation - Profiling
+
+This file contains the Profiler class, which measures where the time of a
+simulation run goes.
+
+A profiler is attached to one simulation, and replaces the methods for each
+phase of a run with timed versions on that simulation object only. Other
+simulations, and this one before the profiler is attached, run exactly the
+same code as before, so profiling costs nothing when it is not used.
+"""
+from collections import deque
+from datetime import datetime
+import json
+import time
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Optional, Tuple
+
+from bikeshare import from_minutes
+
+if TYPE_CHECKING:
+    # Only for annotations: simulation imports this module.
+    from simulation import Simulation
+
+# The phases of a run, and the Simulation method that each one times. The
+# 'render' phase times the visualizer's render_drawables instead.
+PHASES = [('run', '_advance'),
+          ('events', '_update_active_rides_fast'),
+          ('availability', 'update_availability_and_unoccupied'),
+          ('snapshot', 'save_snapshot'),
+          ('drawables', '_drawables'),
+          ('render', 'render_drawables')]
+
+# The number of most recent steps that a profiler keeps by default.
+MAX_STEPS = 1000
+
+
+class Profiler:
+    """A record of the time spent in each phase of simulation runs.
+
+    === Attributes ===
+    seconds:
+        The total wall time spent in each phase, in seconds.
+    calls:
+        The number of times each phase ran.
+    steps:
+        For each of the most recent times that the simulation processed
+        events at, in order: that time, the number of events left in the
+        queue afterwards, and the number of active rides afterwards. The
+        simulation works in minutes since EPOCH, which are converted back to
+        datetimes here. Older steps are dropped, so that a long run doesn't
+        keep one entry per step.
+    peak_queue:
+        The largest number of events left in the queue after any step.
+    peak_active:
+        The largest number of active rides after any step.
+    report_file:
+        The file that the report is saved to, as JSON, at the end of every
+        run, or None if it isn't saved.
+
+    === Representation Invariants ===
+    - seconds and calls have the same keys, which are phases in PHASES
+    - the 'run' phase includes the time of all of the other phases
+    - len(steps) <= steps.maxlen
+    """
+    seconds: Dict[str, float]
+    calls: Dict[str, int]
+    steps: Deque[Tuple[datetime, int, int]]
+    peak_queue: int
+    peak_active: int
+    report_file: Optional[str]
+
+    def __init__(self, report_file: Optional[str] = None,
+                 max_steps: int = MAX_STEPS) -> None:
+        """Initialize an empty profiler that saves its report to
+        <report_file>, if it is given, and keeps the last <max_steps> steps.
+        """
+        self.seconds = {phase: 0.0 for phase, _ in PHASES}
+        self.calls = {phase: 0 for phase, _ in PHASES}
+        self.steps = deque(maxlen=max_steps)
+        self.peak_queue = 0
+        self.peak_active = 0
+        self.report_file = report_file
+
+    def attach(self, simulation: 'Simulation') -> None:
+        """Time every phase of each run of <simulation> from now on.
+        """
+        for phase, name in PHASES:
+            if phase == 'render':
+                if simulation.visualizer is not None:
+                    visualizer = simulation.visualizer
+                    visualizer.render_drawables = self._timed(
+                        phase, visualizer.render_drawables)
+            elif phase == 'events':
+                simulation._update_active_rides_fast = self._timed_events(
+                    simulation, simulation._update_active_rides_fast)
+            else:
+                setattr(simulation, name,
+                        self._timed(phase, getattr(simulation, name)))
+
+    def _timed(self, phase: str, method: Callable) -> Callable:
+        """Return a version of <method> that adds the time it takes to
+        <phase>.
+        """
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.seconds[phase] += time.perf_counter() - started
+            self.calls[phase] += 1
+            if phase == 'run' and self.report_file is not None:
+                self.save(self.report_file)
+            return result
+        return timed
+
+    def _timed_events(self, simulation: 'Simulation',
+                      method: Callable[[int], None]) \
+            -> Callable[[int], None]:
+        """Return a version of <simulation>'s <method> for processing events
+        that is timed like the other phases, and also records a step.
+        """
+        def timed(now: int) -> None:
+            started = time.perf_counter()
+            method(now)
+            self.seconds['events'] += time.perf_counter() - started
+            self.calls['events'] += 1
+            queue = len(simulation.event_priority)
+            active = len(simulation.active_rides)
+            self.peak_queue = max(self.peak_queue, queue)
+            self.peak_active = max(self.peak_active, active)
+            self.steps.append((from_minutes(now), queue, active))
+        return timed
+
+    def report(self) -> Dict[str, object]:
+        """Return a summary of everything this profiler has recorded.
+
+        The summary has a 'phases' key, mapping each phase to its calls,
+        seconds, and share of the run time, including an 'other' phase for
+        the time of the run that isn't in any other phase. It also has the
+        largest number of events in the queue and of active rides over all
+        steps, and the steps that are kept, with times in ISO format.
+        """
+        run = self.seconds['run']
+        phases = {phase: {'calls': self.calls[phase],
+                          'seconds': self.seconds[phase],
+                          'share': self.seconds[phase] / run if run else 0.0}
+                  for phase, _ in PHASES}
+        other = run - sum(self.seconds[phase] for phase, _ in PHASES
+                          if phase != 'run')
+        phases['other'] = {'calls': self.calls['run'], 'seconds': other,
+                           'share': other / run if run else 0.0}
+        return {
+            'phases': phases,
+            'peak queue size': self.peak_queue,
+            'peak active rides': self.peak_active,
+            'steps': [[now.isoformat(), queue, active]
+                      for now, queue, active in self.steps]
+        }
+
+    def save(self, report_file: str) -> None:
+        """Save the report of this profiler to <report_file> as JSON.
+        """
+        with open(report_file, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def format_report(self) -> str:
+        """Return a table of the time spent in each phase, for printing.
+        """
+        report = self.report()
+        lines = ['{:<14}{:>10}{:>12}{:>8}'.format('phase', 'calls',
+                                                  'seconds', 'share')]
+        for phase, row in report['phases'].items():
+            lines.append('{:<14}{:>10}{:>12.4f}{:>7.1%}'.format(
+                phase, row['calls'], row['seconds'], row['share']))
+        lines.append('peak queue size: {}'.format(report['peak queue size']))
+        lines.append('peak active rides: {}'.format(
+            report['peak active rides']))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['save'],
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'collections', 'datetime', 'json', 'time',
+            'bikeshare'
+        ]
+    })
@@ -0,0 +1,333 @@
+"""Bike-share simulation - Columnar ride storage
+
+This file contains the RideTable class, which stores a large number of rides
+column by column in NumPy arrays instead of as a list of Ride objects.
+
+Times are stored as whole minutes since EPOCH, and stations as indices into
+the table's list of stations. Ride objects are only created for the rides a
+simulation actually uses.
+
+It also contains ride_positions, which calculates the positions of many
+rides at once, and the RideMotions class, which does the same for the rides
+of one frame after another, without working out each ride's motion again.
+"""
+from array import array
+import csv
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+from bikeshare import (EPOCH, Ride, Station, from_minutes, parse_datetime,
+                       to_minutes)
+
+
+def ride_positions(rides: List[Ride], time: datetime) -> np.ndarray:
+    """Return the (long, lat) positions of all of <rides> at <time>, as an
+    array with one row per ride.
+
+    Row i is the same as rides[i].get_position(time), but the positions are
+    calculated together from each ride's precomputed motion.
+
+    >>> ride_positions([], datetime(2017, 6, 1)).shape
+    (0, 2)
+    """
+    if not rides:
+        return np.empty((0, 2))
+    return _positions(np.array([ride.motion for ride in rides]), time)
+
+
+class RideMotions:
+    """The motions of the rides that a visualizer draws, kept as the rows of
+    one array from one frame to the next.
+
+    A ride's motion is copied into the array the first time the ride is
+    drawn, so each frame only looks up the rows of its rides, instead of
+    building an array of all of their motions again. The rows of rides that
+    are no longer drawn are dropped whenever the array fills up.
+
+    === Private Attributes ===
+    _rows:
+        Maps each ride with a row to the index of its row in _motion.
+    _motion:
+        Row i is the motion of the ride whose row is i, with the columns of
+        Ride.motion. The rows after the last one in _rows are space for more
+        rides.
+
+    === Representation Invariants ===
+    - the rows in _rows are 0 to len(_rows) - 1
+    - len(_rows) <= len(_motion)
+    """
+    _rows: Dict[Ride, int]
+    _motion: np.ndarray
+
+    def __init__(self, capacity: int = 256) -> None:
+        """Initialize an empty set of motions, with room for <capacity>
+        rides before any rows are dropped.
+        """
+        self._rows = {}
+        self._motion = np.empty((max(capacity, 1), 5))
+
+    def positions(self, rides: List[Ride], time: datetime) -> np.ndarray:
+        """Return the (long, lat) positions of all of <rides> at <time>, as
+        an array with one row per ride, like ride_positions.
+        """
+        if not rides:
+            return np.empty((0, 2))
+        if len(self._rows) + len(rides) > len(self._motion):
+            self._make_room(rides)
+        rows = np.fromiter((self._row(ride) for ride in rides),
+                           dtype=np.intp, count=len(rides))
+        return _positions(self._motion[rows], time)
+
+    def _row(self, ride: Ride) -> int:
+        """Return the index of the row of <ride>, giving it one if it has
+        none.
+
+        Precondition: there is space for one more row in _motion.
+        """
+        row = self._rows.get(ride)
+        if row is None:
+            row = self._rows[ride] = len(self._rows)
+            self._motion[row] = ride.motion
+        return row
+
+    def _make_room(self, rides: List[Ride]) -> None:
+        """Drop the rows of every ride not in <rides>, and make _motion big
+        enough for twice as many rows as there are <rides>.
+
+        Then there is space for every ride in <rides> to get a row, and the
+        next rows are dropped at the earliest after len(rides) more rides
+        have been drawn.
+        """
+        kept = [ride for ride in rides if ride in self._rows]
+        capacity = len(self._motion)
+        while capacity < 2 * len(rides):
+            capacity *= 2
+        motion = np.empty((capacity, 5))
+        motion[:len(kept)] = self._motion[[self._rows[ride]
+                                           for ride in kept]]
+        self._rows = {ride: i for i, ride in enumerate(kept)}
+        self._motion = motion
+
+
+def _positions(motion: np.ndarray, time: datetime) -> np.ndarray:
+    """Return the (long, lat) positions at <time> of the rides whose motions
+    are the rows of <motion>.
+    """
+    elapsed = (time - EPOCH).total_seconds() - motion[:, 4:5]
+    return motion[:, 0:2] + elapsed * motion[:, 2:4]
+
+
+class RideTable:
+    """A table of rides, stored as one NumPy array per column.
+
+    Row i of every array describes the same ride. Rows are in the order of
+    the rides file, or in order of start time in a table returned by
+    sorted_by_start, which can find the rides in a time window without
+    scanning all of them.
+
+    === Attributes ===
+    stations:
+        the stations that the rides in this table refer to
+    start_time:
+        the start time of each ride, in minutes since EPOCH
+    end_time:
+        the end time of each ride, in minutes since EPOCH
+    start_station:
+        the index in <stations> of the station where each ride starts
+    end_station:
+        the index in <stations> of the station where each ride ends
+
+    === Private Attributes ===
+    _first_minute:
+        the first minute covered by _minute_index
+    _minute_index:
+        if the rows are sorted by start time, _minute_index[m] is the first
+        row that starts at or after minute _first_minute + m; otherwise,
+        None
+    _longest:
+        the duration, in minutes, of the longest ride, or None if it hasn't
+        been needed yet
+
+    === Representation Invariants ===
+    - all four arrays have the same length
+    - start_time and end_time have dtype int64
+    - start_station and end_station have dtype int32, and every value is a
+      valid index into stations
+    """
+    stations: List[Station]
+    start_time: np.ndarray
+    end_time: np.ndarray
+    start_station: np.ndarray
+    end_station: np.ndarray
+    _first_minute: int
+    _minute_index: Optional[np.ndarray]
+    _longest: Optional[int]
+
+    def __init__(self, stations: List[Station], start_time: np.ndarray,
+                 end_time: np.ndarray, start_station: np.ndarray,
+                 end_station: np.ndarray) -> None:
+        """Initialize a table with the given stations and columns.
+        """
+        self.stations = stations
+        self.start_time = start_time
+        self.end_time = end_time
+        self.start_station = start_station
+        self.end_station = end_station
+        self._first_minute = 0
+        self._minute_index = None
+        self._longest = None
+
+    def set_minute_index(self, first_minute: int,
+                         minute_index: np.ndarray) -> None:
+        """Use <minute_index> to find the rides that start in a given
+        minute, where minute_index[m] is the first row that starts at or
+        after minute <first_minute> + m.
+
+        Precondition: the rows of this table are sorted by start time, and
+        <minute_index> has an entry for every minute from <first_minute> to
+        one minute after the last start time.
+        """
+        self._first_minute = first_minute
+        self._minute_index = minute_index
+
+    def __len__(self) -> int:
+        """Return the number of rides in this table.
+        """
+        return len(self.start_time)
+
+    def minute_index(self) -> Optional[Tuple[int, np.ndarray]]:
+        """Return the first minute and the minute index that this table
+        finds the rides that start in a given minute with, as passed to
+        set_minute_index, or None if it has no minute index.
+        """
+        if self._minute_index is None:
+            return None
+        return self._first_minute, self._minute_index
+
+    def sorted_by_start(self) -> 'RideTable':
+        """Return a new table with the rides of this table sorted by start
+        time, and a minute index to find them by. Rides that start in the
+        same minute keep their order.
+
+        Looking up the rides that start in a window of the returned table
+        takes time proportional to the number of rides found, not to the
+        number of rides in the table.
+        """
+        order = np.argsort(self.start_time, kind='stable')
+        table = RideTable(self.stations, self.start_time[order],
+                          self.end_time[order], self.start_station[order],
+                          self.end_station[order])
+        first_minute = int(table.start_time[0]) if len(table) else 0
+        last_minute = int(table.start_time[-1]) if len(table) else -1
+        table.set_minute_index(first_minute, np.searchsorted(
+            table.start_time,
+            np.arange(first_minute, last_minute + 2)).astype(np.int64))
+        return table
+
+    def ride(self, i: int) -> Ride:
+        """Return a new Ride object for row <i> of this table.
+        """
+        start_minute, end_minute = int(self.start_time[i]), \
+            int(self.end_time[i])
+        return Ride(self.stations[self.start_station[i]],
+                    self.stations[self.end_station[i]],
+                    (from_minutes(start_minute), from_minutes(end_minute)),
+                    (start_minute, end_minute))
+
+    def rides_starting(self, start: int, end: int) -> Iterator[Ride]:
+        """Yield a new Ride object for each ride in this table that starts
+        between <start> and <end>, inclusive, in minutes since EPOCH, in
+        table order.
+
+        No Ride objects are created for the other rides. If this table has a
+        minute index, the rides are found without scanning the whole table.
+        """
+        if self._minute_index is None:
+            rows = np.flatnonzero((self.start_time >= start) &
+                                  (self.start_time <= end))
+        else:
+            rows = range(self._row_at(start), self._row_at(end + 1))
+        for i in rows:
+            yield self.ride(i)
+
+    def rides_in_progress(self, minute: int) -> Iterator[Ride]:
+        """Yield a new Ride object for each ride in this table that starts
+        before <minute> and ends at or after <minute>, in minutes since
+        EPOCH, in order of start time.
+
+        If this table has a minute index, only the rides that start within
+        the longest ride's duration before <minute> are checked.
+        """
+        if self._minute_index is None:
+            rows = np.flatnonzero((self.start_time < minute) &
+                                  (self.end_time >= minute))
+            rows = rows[np.argsort(self.start_time[rows], kind='stable')]
+        else:
+            if self._longest is None:
+                self._longest = int((self.end_time -
+                                     self.start_time).max(initial=0))
+            first = self._row_at(minute - self._longest)
+            last = self._row_at(minute)
+            rows = first + np.flatnonzero(self.end_time[first:last] >= minute)
+        for i in rows:
+            yield self.ride(i)
+
+    def _row_at(self, minute: int) -> int:
+        """Return the first row that starts at or after <minute>, using the
+        minute index.
+        """
+        offset = minute - self._first_minute
+        if offset <= 0:
+            return 0
+        if offset >= len(self._minute_index):
+            return len(self)
+        return int(self._minute_index[offset])
+
+
+def load_ride_table(rides_file: str,
+                    stations: Dict[str, Station]) -> RideTable:
+    """Return a RideTable with the rides described in the given CSV file.
+
+    This reads the same rides as create_rides, in the same order, but stores
+    only 24 bytes per ride instead of a Ride object.
+
+    Ignore any ride whose start or end station is not present in <stations>.
+
+    Precondition: rides_file matches the format specified in the
+                  assignment handout.
+    """
+    station_index = {station_id: i for i, station_id in enumerate(stations)}
+    minutes = {}
+    start_time, end_time = array('q'), array('q')
+    start_station, end_station = array('i'), array('i')
+
+    with open(rides_file) as file:
+        for line in csv.reader(file):
+            if line[1] not in station_index or line[3] not in station_index:
+                continue
+            for text in (line[0], line[2]):
+                if text not in minutes:
+                    minutes[text] = to_minutes(parse_datetime(text))
+            start_time.append(minutes[line[0]])
+            end_time.append(minutes[line[2]])
+            start_station.append(station_index[line[1]])
+            end_station.append(station_index[line[3]])
+
+    return RideTable(list(stations.values()),
+                     np.frombuffer(start_time, dtype=np.int64),
+                     np.frombuffer(end_time, dtype=np.int64),
+                     np.frombuffer(start_station, dtype=np.int32),
+                     np.frombuffer(end_station, dtype=np.int32))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['load_ride_table'],
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'typing',
+            'array', 'csv', 'datetime', 'numpy',
+            'bikeshare'
+        ]
+    })
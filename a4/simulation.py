@@ -13,18 +13,42 @@ bike-share simulation.
 
 At the bottom of the file, there is a sample_simulation function that you
 can use to try running the simulation at any time.
+
+Inside a run, times are whole numbers of minutes since EPOCH, which are much
+faster to compare and add than datetime objects. Times are converted from
+datetimes when a run starts, and back only to draw a frame, save a snapshot
+or report statistics.
 """
+from bisect import bisect_left, bisect_right
 import csv
 from datetime import datetime, timedelta
+from functools import lru_cache
 import json
-from typing import Dict, List, Tuple
-
-from bikeshare import Ride, Station
-from container import PriorityQueue
-from visualizer import Visualizer
+import os
+import pickle
+from typing import (TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple,
+                    Union)
+
+from bikeshare import (ENDING_RIDES, MINUTE, STARTING_RIDES, STATS, Ride,
+                       Station, StationGrid, from_minutes, parse_datetime,
+                       to_minutes)
+from container import HeapPriorityQueue, TimeWheelQueue
+from leaderboard import Leaderboard
+
+if TYPE_CHECKING:
+    # Only for annotations. These modules need NumPy or pygame, which are
+    # imported only by the simulations that use them.
+    from occupancy import OccupancyRecorder
+    from profiling import Profiler
+    from ridetable import RideTable
+    from visualizer import RenderPolicy, Visualizer
 
 # Datetime format to parse the ride data
 DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+# The number of distinct timestamps that stream_rides keeps parsed. Rides are
+# in order of start time, and a ride's end is close to its start, so the
+# recent timestamps are the ones that come up again.
+TIME_CACHE_SIZE = 4096
 
 
 class Simulation:
@@ -32,48 +56,449 @@ class Simulation:
 
     === Attributes ===
     all_rides:
-        A list of all the rides in this simulation.
+        A list of all the rides in this simulation, or a RideTable holding
+        them, sorted by start time, if this simulation is columnar.
         Note that not all rides might be used, depending on the timeframe
         when the simulation is run.
     all_stations:
         A dictionary containing all the stations in this simulation.
     visualizer:
-        A helper class for visualizing the simulation.
+        A helper class for visualizing the simulation, or None if this
+        simulation is headless.
     active_rides:
-        A list that contains the active rides that progess currently in the
-        time of the simulation
+        The active rides that progess currently in the time of the
+        simulation, as the keys of a dictionary whose values are all None.
+        A dictionary keeps the rides in the order they started, like a list,
+        but adding, removing and finding a ride take constant time.
     event_priority:
-        A PriorityQueue of events that will run for simulation
+        A HeapPriorityQueue of events that will run for simulation, or a
+        TimeWheelQueue of them if this simulation uses a time wheel
+    leaderboard:
+        Ranks the stations by each of their statistics, and is kept up to
+        date as the statistics change.
+    station_grid:
+        A StationGrid of all_stations, for finding the stations in an area
+        or near a point.
+
+    === Private Attributes ===
+    _ride_index:
+        An index of all_rides by time, or None if all_rides is a RideTable.
+    _time_wheel:
+        Whether event_priority is a TimeWheelQueue.
+    _last_minute:
+        The last minute, in minutes since EPOCH, whose events have been
+        processed by a run, or None if this simulation hasn't been run since
+        it was created or its state was last set.
     """
     all_stations: Dict[str, Station]
-    all_rides: List[Ride]
-    visualizer: Visualizer
-    active_rides: List[Ride]
-    event_priority: PriorityQueue['Event']
-
-    def __init__(self, station_file: str, ride_file: str) -> None:
+    all_rides: Union[List[Ride], 'RideTable']
+    visualizer: Optional['Visualizer']
+    active_rides: Dict[Ride, None]
+    event_priority: Union[HeapPriorityQueue['Event'],
+                          TimeWheelQueue['Event']]
+    leaderboard: Leaderboard
+    station_grid: StationGrid
+    _ride_index: Optional['RideIndex']
+    _time_wheel: bool
+    _last_minute: Optional[int]
+
+    def __init__(self, station_file: str, ride_file: str,
+                 headless: bool = False, columnar: bool = False,
+                 render_policy: Optional['RenderPolicy'] = None,
+                 frame_dir: Optional[str] = None,
+                 time_wheel: bool = False) -> None:
         """Initialize this simulation with the given configuration settings.
+
+        If <headless> is True, the simulation never opens a window, and
+        pygame is not even imported. Otherwise, <render_policy> decides which
+        steps are drawn; by default, every step is.
+
+        If <frame_dir> is given, the frames are drawn offscreen and saved as
+        PNG files in the folder <frame_dir>, instead of shown in a window.
+
+        If <columnar> is True, the rides are kept in a RideTable, sorted by
+        start time, and Ride objects are only created for the rides that
+        start while the simulation runs. This needs NumPy, and much less
+        memory.
+
+        If <time_wheel> is True, the events wait in a TimeWheelQueue, with
+        one bucket per minute, instead of a HeapPriorityQueue. The results
+        are the same.
+        """
+        stations = create_stations(station_file)
+        if columnar:
+            # Imported here so that other simulations don't need NumPy.
+            from ridetable import load_ride_table
+            rides = load_ride_table(ride_file, stations)
+        else:
+            rides = list(stream_rides(ride_file, stations))
+        self._setup(stations, rides, headless, render_policy, frame_dir,
+                    time_wheel)
+
+    @classmethod
+    def from_dataset(cls, dataset_file: str, headless: bool = False,
+                     render_policy: Optional['RenderPolicy'] = None,
+                     frame_dir: Optional[str] = None,
+                     time_wheel: bool = False) -> 'Simulation':
+        """Return a new columnar simulation of the stations and rides in the
+        given dataset file, which was written by dataset.compile_dataset.
+
+        The rides are memory-mapped rather than read, so this is fast even
+        for very large datasets.
+        """
+        from dataset import open_dataset
+        stations, rides = open_dataset(dataset_file)
+        return cls.from_data(stations, rides, headless, render_policy,
+                             frame_dir, time_wheel)
+
+    @classmethod
+    def from_data(cls, stations: Dict[str, Station],
+                  rides: Union[List[Ride], 'RideTable'],
+                  headless: bool = False,
+                  render_policy: Optional['RenderPolicy'] = None,
+                  frame_dir: Optional[str] = None,
+                  time_wheel: bool = False) -> 'Simulation':
+        """Return a new simulation of the given stations and rides, which
+        have already been read from their files.
+
+        The simulation changes the state of <stations> when it runs. If
+        <rides> is a RideTable without a minute index, the simulation keeps
+        a copy of it sorted by start time instead.
+        """
+        simulation = cls.__new__(cls)
+        simulation._setup(stations, rides, headless, render_policy,
+                          frame_dir, time_wheel)
+        return simulation
+
+    def _setup(self, stations: Dict[str, Station],
+               rides: Union[List[Ride], 'RideTable'],
+               headless: bool,
+               render_policy: Optional['RenderPolicy'] = None,
+               frame_dir: Optional[str] = None,
+               time_wheel: bool = False) -> None:
+        """Initialize this simulation with the given stations and rides.
+        """
+        if headless:
+            self.visualizer = None
+        else:
+            # Imported here so that headless simulations don't need pygame.
+            from visualizer import Visualizer
+            self.visualizer = Visualizer(render_policy, frame_dir)
+        self.all_stations = stations
+        if isinstance(rides, list):
+            self._ride_index = RideIndex(rides)
+        else:
+            # Without a minute index, every lookup of the rides in a time
+            # window would scan the whole table.
+            if rides.minute_index() is None:
+                rides = rides.sorted_by_start()
+            self._ride_index = None
+        self.all_rides = rides
+        self.active_rides = {}
+        self._time_wheel = time_wheel
+        self.event_priority = self._new_event_queue()
+        self._last_minute = None
+        self.leaderboard = Leaderboard(stations.values(), STATS)
+        self.station_grid = StationGrid(stations.values())
+
+    def run(self, start: datetime, end: datetime, discrete: bool = False,
+            snapshot_file: Optional[str] = None,
+            snapshot_every: timedelta = timedelta(hours=1)) \
+            -> Dict[str, Tuple[str, float]]:
+        """Run the simulation from <start> to <end>, and return the
+        statistics of calculate_statistics once it is done. The rides that
+        start during the run are looked up in an index and loaded into the
+        event queue in one batch, and _update_active_rides_fast is used to
+        process the events for each minute.
+
+        Rides that are already in progress at <start> are active from the
+        beginning. Their bikes have already left their start stations, but
+        they are returned to their end stations as usual.
+
+        If <discrete> is True, the simulation jumps straight from one event
+        time to the next instead of stepping through every minute; see
+        _run_discrete. The statistics are the same either way.
+
+        A simulation can be run again from where its last run ended: the
+        rides that started by then are not started again, so run(a, b)
+        followed by run(b, c) gives the same result as run(a, c).
+
+        If <snapshot_file> is given, a snapshot of the simulation is saved to
+        it after every <snapshot_every> of simulated time, replacing the one
+        before, so that the run can be resumed if it is interrupted.
+
+        A headless or offscreen simulation returns as soon as <end> is
+        reached, and every frame has been saved; otherwise, this returns
+        once the visualization window is closed.
+        """
+        start, end = to_minutes(start), to_minutes(end)
+        self._load_events(start, end, self._rides_in_progress(start))
+        self._advance(start, end, discrete, snapshot_file,
+                      snapshot_every // MINUTE)
+        return self._finish()
+
+    def resume(self, snapshot_file: str, end: datetime,
+               discrete: bool = False,
+               snapshot_every: Optional[timedelta] = None) \
+            -> Dict[str, Tuple[str, float]]:
+        """Continue a run from the snapshot in <snapshot_file> until <end>,
+        and return the statistics of calculate_statistics once it is done.
+
+        This simulation must have been created from the same stations and
+        rides as the one that saved the snapshot. Its current state is
+        replaced by the saved one, and running on to <end> gives the same
+        result as if the original run had never stopped. Several simulations
+        can resume from the same snapshot, for example to try out different
+        scenarios from the same starting point.
+
+        If <snapshot_every> is given, new snapshots are saved to
+        <snapshot_file> as in run.
+        """
+        time, active_rides = self._restore(snapshot_file)
+        end = to_minutes(end)
+        self._load_events(time, end, active_rides)
+        if snapshot_every is None:
+            self._advance(time, end, discrete, None, 60)
+        else:
+            self._advance(time, end, discrete, snapshot_file,
+                          snapshot_every // MINUTE)
+        return self._finish()
+
+    def save_snapshot(self, time: int, snapshot_file: str) -> None:
+        """Save the state of this simulation at <time>, in minutes since
+        EPOCH, to <snapshot_file>.
+
+        The events at <time> must not have been processed yet. The snapshot
+        holds the number of bikes, unoccupied spots and statistics of every
+        station, and the rides that are active. The pending events are not
+        saved: they are the ends of the active rides and the starts of the
+        later rides, which resume finds again.
+
+        The snapshot is written to a temporary file first, so an interrupted
+        save never replaces a good snapshot with a broken one.
+        """
+        for station in self.all_stations.values():
+            station.credit_interval(time)
+        with open(snapshot_file + '.tmp', 'wb') as file:
+            pickle.dump(self.get_state(from_minutes(time)), file,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+
+    def _restore(self, snapshot_file: str) -> Tuple[int, List[Ride]]:
+        """Put the stations of this simulation in the state saved in
+        <snapshot_file>, and return the time of the snapshot, in minutes
+        since EPOCH, and the rides that were active.
+        """
+        with open(snapshot_file, 'rb') as file:
+            return self.set_state(pickle.load(file))
+
+    def get_state(self, time: datetime) -> Dict[str, object]:
+        """Return the state of this simulation at <time>, as plain data.
+
+        The state is a dictionary with these keys:
+        - 'time': <time>, in minutes since EPOCH
+        - 'stations': maps each station id to the station's number of bikes,
+          number of unoccupied spots, and list of statistics in the order of
+          STATS
+        - 'active rides': a (start station id, end station id, start time,
+          end time) tuple for each active ride, in the order they started,
+          with times in minutes since EPOCH
+        """
+        station_ids = {}
+        stations = {}
+        for station_id, station in self.all_stations.items():
+            station_ids[station] = station_id
+            stations[station_id] = (station.num_bikes, station.unocc_spots,
+                                    list(station.counts))
+        return {
+            'time': to_minutes(time),
+            'stations': stations,
+            'active rides': [(station_ids[ride.start], station_ids[ride.end],
+                              ride.start_minute, ride.end_minute)
+                             for ride in self.active_rides]
+        }
+
+    def set_state(self, state: Dict[str, object]) \
+            -> Tuple[int, List[Ride]]:
+        """Put the stations of this simulation in <state>, which has the
+        form returned by get_state, and return the time of the state, in
+        minutes since EPOCH, and new Ride objects for its active rides.
+
+        The event queue is emptied, and no ride is active until the returned
+        rides are passed to _load_events.
+        """
+        for station_id, (num_bikes, unocc_spots, stats) in \
+                state['stations'].items():
+            station = self.all_stations[station_id]
+            station.reset(num_bikes)
+            station.unocc_spots = unocc_spots
+            for stat, value in enumerate(stats):
+                if value:
+                    station.record(stat, value)
+        self.active_rides = {}
+        self.event_priority = self._new_event_queue()
+        self._last_minute = None
+
+        active_rides = [Ride(self.all_stations[start_id],
+                             self.all_stations[end_id],
+                             (from_minutes(start_time),
+                              from_minutes(end_time)),
+                             (start_time, end_time))
+                        for start_id, end_id, start_time, end_time in
+                        state['active rides']]
+        return state['time'], active_rides
+
+    def profile(self, report_file: Optional[str] = None) -> 'Profiler':
+        """Start recording how long each phase of this simulation's runs
+        takes, and return the Profiler that holds the measurements.
+
+        If <report_file> is given, the profiler's report is saved to it as
+        JSON at the end of every run.
+        """
+        from profiling import Profiler
+        profiler = Profiler(report_file)
+        profiler.attach(self)
+        return profiler
+
+    def record_occupancy(self, capacity: int = 4096) -> 'OccupancyRecorder':
+        """Start recording the number of bikes and unoccupied spots of
+        every station through this simulation's runs, and return the
+        OccupancyRecorder that holds the history.
+
+        The recorder starts with room for <capacity> changes, and grows as
+        needed.
         """
-        self.visualizer = Visualizer()
-        self.all_stations = create_stations(station_file)
-        self.all_rides = create_rides(ride_file, self.all_stations)
-        self.active_rides = []
-        self.event_priority = PriorityQueue()
+        from occupancy import OccupancyRecorder
+        recorder = OccupancyRecorder(list(self.all_stations), capacity)
+        recorder.attach(self)
+        return recorder
+
+    def _new_event_queue(self) -> Union[HeapPriorityQueue['Event'],
+                                        TimeWheelQueue['Event']]:
+        """Return a new, empty queue of the kind this simulation keeps its
+        events in.
+        """
+        if self._time_wheel:
+            return TimeWheelQueue(_event_minute)
+        return HeapPriorityQueue()
+
+    def _load_events(self, start: int, end: int,
+                     active_rides: Iterator[Ride]) -> None:
+        """Make <active_rides> active, and add the events for a run from
+        <start> to <end>, in minutes since EPOCH, to the event queue: the
+        start of every ride that starts during the run, followed by the end
+        of every active ride.
+
+        If an earlier run has processed the events up to _last_minute, the
+        rides that started by then are left out: they were started, and if
+        still active, have their end events queued, by that run.
+        """
+        if self._last_minute is not None:
+            start = max(start, self._last_minute + 1)
+            active_rides = (ride for ride in active_rides
+                            if ride.start_minute > self._last_minute)
+        events = [RideStartEvent(self, ride.start_minute, ride)
+                  for ride in self._rides_starting(start, end)]
+        for ride in active_rides:
+            self.active_rides[ride] = None
+            events.append(RideEndEvent(self, ride.end_minute, ride))
+        self.event_priority.add_all(events)
+
+    def _advance(self, start: int, end: int, discrete: bool,
+                 snapshot_file: Optional[str], snapshot_every: int,
+                 inclusive: bool = True) -> None:
+        """Process the loaded events from <start> to <end>, in minutes since
+        EPOCH, saving snapshots to <snapshot_file> every <snapshot_every>
+        minutes if it is not None.
+
+        If <inclusive> is False, the events at <end> are left in the queue,
+        so the run covers the time from <start> up to, but not including,
+        <end>, and a later run from <end> carries on exactly where this one
+        stopped.
+        """
+        if discrete:
+            self._run_discrete(start, end, snapshot_file, snapshot_every,
+                               inclusive)
+        else:
+            self._run_minutes(start, end, snapshot_file, snapshot_every,
+                              inclusive)
+        last = end if inclusive else end - 1
+        if last >= start:
+            self._last_minute = last
+
+    def _finish(self) -> Dict[str, Tuple[str, float]]:
+        """Return the statistics of this simulation once the user has closed
+        the visualization window, or right away if it is headless.
+        """
+        if self.visualizer is None:
+            return self.calculate_statistics()
+
+        # Leave this code at the very bottom of this method.
+        # It will keep the visualization window open until you close
+        # it by pressing the 'X'.
+
+        while True:
+            if self.visualizer.handle_window_events():
+                return self.calculate_statistics()  # Stop the simulation
 
-    def run(self, start: datetime, end: datetime) -> None:
-        """Run the simulation from <start> to <end>. Currently, the updating
-        rides method is being used. The _update_active_rides_fast method is
-        currently commented out.
+    def _rides_starting(self, start: int, end: int) -> Iterator[Ride]:
+        """Yield the rides that start between <start> and <end>, inclusive,
+        in minutes since EPOCH, in order of start time. Rides that start at
+        the same time are in the order of the rides file.
         """
-        for ride in self.all_rides:
-            #if ride.start_time >= start:
-                self.event_priority.add(RideStartEvent(self, ride.start_time,
-                                                       ride))
-                #self.update_taking_station(ride, end)
-                self.update_giving_station(ride, start)
-        step = timedelta(minutes=1)  # Each iteration spans one minute of time
+        if self._ride_index is not None:
+            return iter(self._ride_index.starting(start, end))
+        return self.all_rides.rides_starting(start, end)
 
-        while start <= end:
+    def _rides_in_progress(self, time: int) -> Iterator[Ride]:
+        """Yield the rides that started before <time> and end at or after
+        <time>, in minutes since EPOCH, in order of start time.
+        """
+        if self._ride_index is not None:
+            return iter(self._ride_index.in_progress(time))
+        return self.all_rides.rides_in_progress(time)
+
+    def _render(self, time: int, final: bool = False) -> None:
+        """Draw the stations and active rides at <time>, in minutes since
+        EPOCH, unless this simulation is headless or its render policy skips
+        this step.
+
+        <final> is True for the last step of a run, which is always drawn.
+        """
+        if self.visualizer is None:
+            return
+        time = from_minutes(time)
+        if self.visualizer.should_render(time, final):
+            self.visualizer.render_drawables(self._drawables(), time)
+
+    def _drawables(self) -> List[Union[Station, Ride]]:
+        """Return the stations and active rides, to be drawn.
+
+        Only the stations in the visible part of the map are returned, and
+        station_grid finds them without checking every station.
+        """
+        if self.visualizer is None:
+            stations = list(self.all_stations.values())
+        else:
+            stations = self.station_grid.in_box(
+                *self.visualizer.visible_area())
+        return stations + list(self.active_rides)
+
+    def _run_minutes(self, start: int, end: int,
+                     snapshot_file: Optional[str] = None,
+                     snapshot_every: int = 60,
+                     inclusive: bool = True) -> None:
+        """Step the simulation from <start> to <end>, in minutes since EPOCH,
+        one minute at a time, saving a snapshot to <snapshot_file>, if it is
+        given, whenever a multiple of <snapshot_every> minutes has passed.
+
+        If <inclusive> is False, the minute at <end> is left out.
+        """
+        step = 1  # Each iteration spans one minute of time
+        first = start
+        last = end if inclusive else end - step
+
+        while start <= last:
 
             self._update_active_rides_fast(start)
             #self._update_active_rides(start)
@@ -81,19 +506,66 @@ class Simulation:
             if start < end:
 
                 self.update_availability_and_unoccupied()
-            self.visualizer.render_drawables(
-                list(self.all_stations.values()) + self.active_rides, start)
+                if snapshot_file is not None and \
+                        (start + step - first) % snapshot_every == 0:
+                    self.save_snapshot(start + step, snapshot_file)
+            self._render(start, start == last)
             start += step
             # if start == end:
             #      self.active_rides = []
 
-        # Leave this code at the very bottom of this method.
-        # It will keep the visualization window open until you close
-        # it by pressing the 'X'.
+    def _run_discrete(self, start: int, end: int,
+                      snapshot_file: Optional[str] = None,
+                      snapshot_every: int = 60,
+                      inclusive: bool = True) -> None:
+        """Step the simulation from <start> to <end>, in minutes since EPOCH,
+        by jumping from one event time straight to the next, saving a
+        snapshot to <snapshot_file>, if it is given, whenever a multiple of
+        <snapshot_every> minutes has passed.
+
+        If <inclusive> is False, the events at <end> are not processed, but
+        time is still credited up to <end>.
+
+        Rather than checking every station once a minute, each station credits
+        its low availability and low unoccupied time for a whole interval
+        whenever its number of bikes is about to change, and once more at
+        <end>. The cost is proportional to the number of events, not to the
+        number of minutes times the number of stations.
+
+        Like _run_minutes, this does nothing if there is no minute from
+        <start> to <end> to step through.
+        """
+        if end < start or (end == start and not inclusive):
+            return
+        for station in self.all_stations.values():
+            station.begin_interval(start)
+        next_snapshot = start + snapshot_every
 
+        time = start
         while True:
-            if self.visualizer.handle_window_events():
-                return  # Stop the simulation
+            self._update_active_rides_fast(time)
+            if self.event_priority.is_empty() or \
+                    self.event_priority.peek().time > end or \
+                    (self.event_priority.peek().time == end and
+                     not inclusive):
+                break
+            self._render(time)
+            time = self.event_priority.peek().time
+            # Nothing changes between two events, so a snapshot for any time
+            # up to the next event can be saved now.
+            while snapshot_file is not None and next_snapshot <= time:
+                self.save_snapshot(next_snapshot, snapshot_file)
+                next_snapshot += snapshot_every
+
+        while snapshot_file is not None and next_snapshot <= end:
+            self.save_snapshot(next_snapshot, snapshot_file)
+            next_snapshot += snapshot_every
+        # Nothing changes after the last event, so the final frame is drawn
+        # at <end> rather than at the time of that event.
+        self._render(end, True)
+        for station in self.all_stations.values():
+            station.credit_interval(end)
+            station.begin_interval(None)
 
     def update_availability_and_unoccupied(self):
         """
@@ -103,48 +575,49 @@ class Simulation:
             station.low_availabilty()
             station.low_unoccupied()
 
-    def update_giving_station(self, ride: Ride, time: datetime) -> None:
+    def update_giving_station(self, ride: Ride, time: int) -> None:
         """Decrease the num_bikes of a station if the ride is being
-        added to the active rides list
+        added to the active rides list at <time>, in minutes since EPOCH
         """
-        if ride.start_time == time:
+        if ride.start_minute == time:
             if ride.start.num_bikes > 0 and ride.start. \
                         unocc_spots != ride.start.capacity:
+                ride.start.credit_interval(time)
                 ride.start.num_bikes -= 1
-                ride.start.stats['starting rides'] += 1
+                ride.start.record(STARTING_RIDES, 1)
                 ride.start.unocc_spots += 1
-                self.active_rides.append(ride)
+                self.active_rides[ride] = None
 
-    def update_taking_station(self, ride: Ride, time: datetime) -> None:
+    def update_taking_station(self, ride: Ride, time: int) -> None:
         """Increase the num_bikes of a station if the ride is
         being added to the active rides list only if we haven't exceeded the
-        station capacity yet."""
-        if ride.end_time == time and ride in self.active_rides:
+        station capacity yet. <time> is in minutes since EPOCH."""
+        if ride.end_minute == time and ride in self.active_rides:
             if ride.end.capacity > ride.end.num_bikes and ride.end.unocc_spots>0:
-                ride.end.num_bikes += 1
-                ride.end.stats['ending rides'] += 1
+                ride.end.credit_interval(time)
+                ride.end.record(ENDING_RIDES, 1)
                 ride.end.num_bikes += 1
                 ride.end.unocc_spots -= 1
-                self.active_rides.remove(ride)
+                del self.active_rides[ride]
             else:
-                self.active_rides.remove(ride)
+                del self.active_rides[ride]
 
-    def _update_active_rides_fast(self, time: datetime) -> None:
-        """Update this simulation's list of active rides for the given time.
+    def _update_active_rides_fast(self, time: int) -> None:
+        """Update this simulation's list of active rides for the given time,
+        in minutes since EPOCH.
 
         REQUIRED IMPLEMENTATION NOTES:
         -   see Task 5 of the assignment handout
         """
-        while not self.event_priority.is_empty():
+        while not self.event_priority.is_empty() and \
+                self.event_priority.peek().time <= time:
             current_event = self.event_priority.remove()
-            if current_event.ride.start_time > time:
-                self.event_priority.add(current_event)
-                return
-            else:
-                self.event_priority.add(current_event.process())
+            for new_event in current_event.process():
+                self.event_priority.add(new_event)
 
-    def _update_active_rides(self, time: datetime) -> None:
-        """Update this simulation's list of active rides for the given time.
+    def _update_active_rides(self, time: int) -> None:
+        """Update this simulation's list of active rides for the given time,
+        in minutes since EPOCH.
 
         REQUIRED IMPLEMENTATION NOTES:
         -   Loop through `self.all_rides` and compare each Ride's start and
@@ -160,46 +633,51 @@ class Simulation:
         -   This means that if a ride started before the simulation's time
             period but ends during or after the simulation's time period,
             it should still be added to self.active_rides.
+
+        This only supports simulations whose all_rides is a list.
         """
         for current_ride in self.all_rides:
             ride_station_start = current_ride.start
             ride_station_end = current_ride.end
 
-            s = current_ride.start_time
-            e = current_ride.end_time
+            s = current_ride.start_minute
+            e = current_ride.end_minute
             if time == s and time < e:
                 if ride_station_start.num_bikes > 0 and ride_station_start. \
                         unocc_spots != ride_station_start.capacity:
                     ride_station_start.num_bikes -= 1
-                    ride_station_start.stats['starting rides'] += 1
+                    ride_station_start.record(STARTING_RIDES, 1)
                     ride_station_start.unocc_spots += 1
-                    self.active_rides.append(current_ride)
+                    self.active_rides[current_ride] = None
             if time == e and current_ride in self.active_rides:
                 if ride_station_end.num_bikes < ride_station_end.capacity and \
                                 ride_station_end.unocc_spots > 0:
-                    ride_station_end.stats['ending rides'] += 1
+                    ride_station_end.record(ENDING_RIDES, 1)
                     ride_station_end.num_bikes += 1
                     ride_station_end.unocc_spots -= 1
-                    self.active_rides.remove(current_ride)
+                    del self.active_rides[current_ride]
                 else:
-                    self.active_rides.remove(current_ride)
+                    del self.active_rides[current_ride]
 
     def concise_stats(self, all_stations: Dict, current_stats: str) \
             -> Tuple[str, float]:
-        """A helper method for the calculate_statistics method so that the
-        the same code is not being written multiple times for the very same
-        results. Example of function level modularity.
+        """Return the name and value of the station in <all_stations> with
+        the largest value of <current_stats>, breaking ties by smallest name.
+
+        This checks every station. calculate_statistics reads the same
+        result from the leaderboard instead.
         """
         max_start = -1
         max_start_name = None
+        stat = STATS.index(current_stats)
 
         for station in all_stations.values():
-            if station.stats[current_stats] >= max_start:
-                if station.stats[current_stats] > max_start:
-                    max_start = station.stats[current_stats]
+            if station.counts[stat] >= max_start:
+                if station.counts[stat] > max_start:
+                    max_start = station.counts[stat]
                     max_start_name = station.name
 
-                elif station.stats[current_stats] == max_start:
+                elif station.counts[stat] == max_start:
                     if station.name < max_start_name:
                         max_start_name = station.name
         return max_start_name, max_start
@@ -222,17 +700,29 @@ class Simulation:
         For example, the value corresponding to key 'max_start' should be the
         name of the station with the most number of rides started at that
         station, and the number of rides that started at that station.
+
+        Each value is read from the leaderboard, so this takes constant time
+        and can be called as often as needed while the simulation runs.
         """
         return {
-            'max_start': self.concise_stats(self.all_stations,
-                                            'starting rides'),
-            'max_end': self.concise_stats(self.all_stations, 'ending rides'),
-            'max_time_low_availability': self.concise_stats(self.all_stations,
-                                                            'low availability'),
-            'max_time_low_unoccupied': self.concise_stats(self.all_stations,
-                                                          'low unoccupied')
+            'max_start': self.leaderboard.leader('starting rides'),
+            'max_end': self.leaderboard.leader('ending rides'),
+            'max_time_low_availability': self.leaderboard.leader(
+                'low availability'),
+            'max_time_low_unoccupied': self.leaderboard.leader(
+                'low unoccupied')
         }
 
+    def top_k(self, stat: str, k: int) -> List[Tuple[str, float]]:
+        """Return the names and values of the <k> stations with the largest
+        values of <stat>, from largest to smallest, breaking ties by smallest
+        name.
+
+        <stat> is one of the statistics in STATS. This takes O(k log k)
+        time, however many stations there are; see Leaderboard.top_k.
+        """
+        return self.leaderboard.top_k(stat, k)
+
 
 def create_stations(stations_file: str) -> Dict[str, 'Station']:
     """Return the stations described in the given JSON data file.
@@ -309,15 +799,197 @@ def create_rides(rides_file: str,
     return rides
 
 
+def stream_rides(rides_file: str, stations: Dict[str, 'Station'],
+                 start: Optional[datetime] = None,
+                 end: Optional[datetime] = None) -> Iterator['Ride']:
+    """Yield the rides described in the given CSV file, one at a time.
+
+    This reads the same rides as create_rides, in the same order, but only
+    holds one line of the file in memory at a time. The last TIME_CACHE_SIZE
+    distinct timestamps are kept parsed, so each of them is usually parsed
+    only once, and its rides share the same datetime and minute.
+
+    If <start> is given, rides that end before <start> are skipped, and if
+    <end> is given, rides that start after <end> are skipped. The rides that
+    are left are the ones that overlap the window from <start> to <end>.
+
+    Precondition: rides_file matches the format specified in the
+                  assignment handout.
+    """
+    parse_time = lru_cache(maxsize=TIME_CACHE_SIZE)(_parse_time)
+    with open(rides_file) as file:
+        for line in csv.reader(file):
+            if line[1] not in stations or line[3] not in stations:
+                continue
+
+            start_time = parse_time(line[0])
+            if end is not None and start_time[0] > end:
+                continue
+            end_time = parse_time(line[2])
+            if start is not None and end_time[0] < start:
+                continue
+
+            yield Ride(stations[line[1]], stations[line[3]],
+                       (start_time[0], end_time[0]),
+                       (start_time[1], end_time[1]))
+
+
+def _parse_time(text: str) -> Tuple[datetime, int]:
+    """Return the datetime described by <text>, which is in DATETIME_FORMAT,
+    and the same time in minutes since EPOCH.
+    """
+    time = parse_datetime(text)
+    return time, to_minutes(time)
+
+
+class RideIndex:
+    """An index of rides by time, for finding the rides in a time window
+    without checking every ride.
+
+    === Private Attributes ===
+    _rides:
+        The indexed rides, sorted by start time. Rides with the same start
+        time are in their original order.
+    _start_times:
+        The start time of each ride in _rides, in minutes since EPOCH, in
+        the same order.
+    _tree:
+        The root of an interval tree of the minutes each ride is in
+        progress, or None if no ride is ever in progress.
+    """
+    _rides: List[Ride]
+    _start_times: List[int]
+    _tree: Optional['_IntervalNode']
+
+    def __init__(self, rides: List[Ride]) -> None:
+        """Initialize an index of <rides>.
+        """
+        self._rides = sorted(rides, key=lambda ride: ride.start_minute)
+        self._start_times = [ride.start_minute for ride in self._rides]
+        # A ride is in progress from the minute after it starts until the
+        # minute it ends, inclusive, so rides that end when they start are
+        # never in progress.
+        self._tree = _IntervalNode.build(
+            [(ride.start_minute + 1, ride.end_minute, rank)
+             for rank, ride in enumerate(self._rides)
+             if ride.start_minute < ride.end_minute])
+
+    def starting(self, start: int, end: int) -> List[Ride]:
+        """Return the rides that start between <start> and <end>, inclusive,
+        in minutes since EPOCH.
+
+        This takes O(log n + k) time to find k of the n indexed rides.
+        """
+        return self._rides[bisect_left(self._start_times, start):
+                           bisect_right(self._start_times, end)]
+
+    def in_progress(self, time: int) -> List[Ride]:
+        """Return the rides that start before <time> and end at or after
+        <time>, in minutes since EPOCH, in order of start time.
+
+        The interval tree is searched along one path from its root, so this
+        takes O(log n + k log k) time to find k of the n indexed rides, the
+        last term only to put them back in order, however long any of the
+        rides are.
+        """
+        ranks = []
+        node = self._tree
+        while node is not None:
+            node.stab(time, ranks)
+            node = node.left if time < node.center else node.right
+        ranks.sort()
+        return [self._rides[rank] for rank in ranks]
+
+
+class _IntervalNode:
+    """A node of a centered interval tree over closed intervals of whole
+    minutes, each labelled with a rank.
+
+    === Attributes ===
+    center:
+        The minute this node splits its intervals at.
+    by_first:
+        The (first minute, rank) of each interval of this node, sorted by
+        first minute.
+    by_last:
+        The (last minute, rank) of each interval of this node, sorted by
+        last minute, latest first.
+    left:
+        The tree of the intervals that end before center, or None if there
+        are none.
+    right:
+        The tree of the intervals that start after center, or None if there
+        are none.
+
+    === Representation Invariants ===
+    - every interval of this node contains center
+    """
+    __slots__ = ('center', 'by_first', 'by_last', 'left', 'right')
+    center: int
+    by_first: List[Tuple[int, int]]
+    by_last: List[Tuple[int, int]]
+    left: Optional['_IntervalNode']
+    right: Optional['_IntervalNode']
+
+    @staticmethod
+    def build(intervals: List[Tuple[int, int, int]]) \
+            -> Optional['_IntervalNode']:
+        """Return the root of a tree of <intervals>, given as (first minute,
+        last minute, rank) tuples, or None if there are none.
+
+        Each node splits its intervals at the median of their endpoints, so
+        neither side gets more than half of them, and the tree has depth
+        O(log n).
+        """
+        if not intervals:
+            return None
+        endpoints = sorted(minute for first, last, _ in intervals
+                           for minute in (first, last))
+        node = _IntervalNode()
+        node.center = endpoints[len(endpoints) // 2]
+        here = [interval for interval in intervals
+                if interval[0] <= node.center <= interval[1]]
+        node.by_first = sorted((first, rank) for first, _, rank in here)
+        node.by_last = sorted(((last, rank) for _, last, rank in here),
+                              key=lambda pair: -pair[0])
+        node.left = _IntervalNode.build(
+            [interval for interval in intervals if interval[1] < node.center])
+        node.right = _IntervalNode.build(
+            [interval for interval in intervals if interval[0] > node.center])
+        return node
+
+    def stab(self, minute: int, ranks: List[int]) -> None:
+        """Append the rank of each interval of this node that contains
+        <minute> to <ranks>.
+
+        Every interval of this node contains center, so only one end of each
+        needs to be checked, and the check stops at the first interval that
+        doesn't contain <minute>.
+        """
+        if minute <= self.center:
+            for first, rank in self.by_first:
+                if first > minute:
+                    break
+                ranks.append(rank)
+        else:
+            for last, rank in self.by_last:
+                if last < minute:
+                    break
+                ranks.append(rank)
+
+
 class Event:
     """An event in the bike share simulation.
 
-    Events are ordered by their timestamp.
+    Events are ordered by their timestamp, which is in minutes since
+    EPOCH. Like Drawables, events declare their attributes in __slots__,
+    since a run creates one or two for every ride.
     """
+    __slots__ = ('simulation', 'time')
     simulation: 'Simulation'
-    time: datetime
+    time: int
 
-    def __init__(self, simulation: 'Simulation', time: datetime) -> None:
+    def __init__(self, simulation: 'Simulation', time: int) -> None:
         """Initialize a new event."""
         self.simulation = simulation
         self.time = time
@@ -336,11 +1008,18 @@ class Event:
         raise NotImplementedError
 
 
+def _event_minute(event: Event) -> int:
+    """Return the time of <event>, in minutes since EPOCH.
+    """
+    return event.time
+
+
 class RideStartEvent(Event):
     """An event corresponding to the start of a ride."""
+    __slots__ = ('ride',)
     ride: Ride
 
-    def __init__(self, sim: 'Simulation', time: datetime, ride: Ride) -> None:
+    def __init__(self, sim: 'Simulation', time: int, ride: Ride) -> None:
         """Initialize a new event."""
         Event.__init__(self, sim, time)
         self.ride = ride
@@ -350,29 +1029,30 @@ class RideStartEvent(Event):
             Return a list of new events spawned by this event.
         """
         start_ride = []
-        self.simulation.active_rides.append(self.ride)
         self.simulation.update_giving_station(self.ride, self.time)
-        start_ride.append(RideEndEvent(self.simulation, self.ride.end_time,
-                                       self.ride))
+        if self.ride in self.simulation.active_rides:
+            start_ride.append(RideEndEvent(self.simulation,
+                                           self.ride.end_minute, self.ride))
 
         return start_ride
 
 
 class RideEndEvent(Event):
     """An event corresponding to the start of a ride."""
+    __slots__ = ('ride',)
     ride: Ride
 
-    def __init__(self, sim: 'Simulation', time: datetime, ride: Ride) -> None:
+    def __init__(self, sim: 'Simulation', time: int, ride: Ride) -> None:
         Event.__init__(self, sim, time)
         self.ride = ride
 
-    def process(self) -> None:
+    def process(self) -> List['Event']:
         """Process this event by updating the state of the simulation.
         Return a list of new events spawned by this event.
         """
 
         self.simulation.update_taking_station(self.ride, self.time)
-        self.simulation.active_rides.remove(self.ride)
+        return []
 
 
 def sample_simulation() -> Dict[str, Tuple[str, float]]:
@@ -388,11 +1068,15 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'allowed-io': ['create_stations', 'create_rides'],
+        'allowed-io': ['create_stations', 'create_rides', 'stream_rides',
+                       'save_snapshot', '_restore'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'csv', 'datetime', 'json',
-            'bikeshare', 'container', 'visualizer'
+            'bisect', 'csv', 'datetime', 'functools', 'json', 'os',
+            'pickle',
+            'bikeshare', 'container', 'dataset', 'leaderboard', 'occupancy',
+            'profiling', 'ridetable',
+            'visualizer'
         ]
     })
     print(sample_simulation())
@@ -14,16 +14,29 @@ There's quite a bit in this file, but you aren't responsible for most of it.
 (You'll be doing more with Pygame on Assignment 2, though!)
 
 It also contains the Map class, which is responsible for converting between
-lat/long coordinates and pixel coordinates on the pygame window.
+lat/long coordinates and pixel coordinates on the pygame window, and the
+FrameWriter class, which saves frames as image files on a background thread.
 
-DO NOT CHANGE ANY CODE IN THIS FILE. You don't need to for this assignment,
-and in fact you aren't even submitting this file!
+Drawing a frame is kept cheap by caching in Map: sprites are loaded and
+scaled to every zoom level only once, and the scaled map view and the pixel
+coordinates of the stations are only worked out again after the map has
+been panned or zoomed.
 """
-from datetime import datetime
+from datetime import datetime, timedelta
+import math
 import os
-from typing import List, Tuple
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 import pygame
-from bikeshare import Drawable
+from bikeshare import Drawable, Ride
+
+if TYPE_CHECKING:
+    # Only for annotations. NumPy is imported where rides are drawn, so that
+    # a visualizer works without it.
+    import numpy as np
+    from ridetable import RideMotions
 
 
 WHITE = (255, 255, 255)
@@ -35,32 +48,159 @@ MAP_MAX = (-73.471199, 45.425780)
 # Window size
 SCREEN_SIZE = (960, 787)
 
+# The range of zoom levels for the map, and the step between two levels.
+MIN_ZOOM = 1
+MAX_ZOOM = 4
+ZOOM_STEP = 0.1
+
+# The width and height, in pixels, that every sprite fits in at every zoom.
+SPRITE_MARGIN = 100
+
+# Convert between surfaces and their pixels as bytes. pygame 2.1.3 renamed
+# tostring and fromstring to tobytes and frombytes, and deprecated the old
+# names, which are the only ones that older versions have.
+image_to_bytes = getattr(pygame.image, 'tobytes', pygame.image.tostring)
+image_from_bytes = getattr(pygame.image, 'frombytes',
+                           pygame.image.fromstring)
+
+
+class RenderPolicy:
+    """A rule for which simulation steps are drawn.
+
+    A step is drawn if at least 1 / max_fps seconds of wall time and at least
+    <every> of simulated time have passed since the last frame. Between
+    frames, the simulation runs as fast as it can. The last step of a run is
+    always drawn, so the window ends up showing the final state.
+
+    The default policy draws every step.
+
+    === Attributes ===
+    max_fps:
+        the most frames to draw per second of wall time, or None for no
+        limit
+    every:
+        the least simulated time between two frames, or None for no limit
+
+    === Private Attributes ===
+    _last_frame:
+        the wall time, from time.perf_counter, of the last frame, or None
+        if no frame has been drawn
+    _last_time:
+        the simulated time of the last frame, or None if no frame has been
+        drawn
+    """
+    max_fps: Optional[float]
+    every: Optional[timedelta]
+    _last_frame: Optional[float]
+    _last_time: Optional[datetime]
+
+    def __init__(self, max_fps: Optional[float] = None,
+                 every: Optional[timedelta] = None) -> None:
+        """Initialize a policy that draws at most <max_fps> frames per
+        second, and at most one frame per <every> of simulated time.
+
+        Raise a ValueError if <max_fps> is not positive.
+        """
+        if max_fps is not None and max_fps <= 0:
+            raise ValueError('max_fps must be positive, or None for no limit, '
+                             'not {}'.format(max_fps))
+        self.max_fps = max_fps
+        self.every = every
+        self._last_frame = None
+        self._last_time = None
+
+    def claim_frame(self, time: datetime, final: bool = False) -> bool:
+        """Return whether the step at simulated <time> should be drawn,
+        and if so, count it as the last frame.
+
+        If <final> is True, the step is the last one of a run, and is always
+        drawn. A step earlier than the last frame, as in a new run, is
+        always drawn too.
+
+        >>> policy = RenderPolicy(every=timedelta(minutes=5))
+        >>> start = datetime(2017, 6, 1, 8)
+        >>> [minute for minute in range(12)
+        ...  if policy.claim_frame(start + timedelta(minutes=minute),
+        ...                        minute == 11)]
+        [0, 5, 10, 11]
+        """
+        now = perf_counter()
+        if not final:
+            if self.every is not None and self._last_time is not None and \
+                    self._last_time <= time < self._last_time + self.every:
+                return False
+            if self.max_fps is not None and self._last_frame is not None \
+                    and now - self._last_frame < 1 / self.max_fps:
+                return False
+        self._last_frame = now
+        self._last_time = time
+        return True
+
 
 class Visualizer:
     """Visualizer for the current state of a simulation.
+
+    A visualizer either shows its frames in a window, or, if it is
+    offscreen, draws them on a surface that is never displayed and saves
+    each one as a PNG file.
+
+    === Attributes ===
+    render_policy:
+        decides which steps of the simulation are drawn
     """
     # === Private attributes ===
-    # _screen: the pygame window that is shown to the user.
+    # _screen: the pygame window that is shown to the user, or the surface
+    #   that frames are drawn on if this visualizer is offscreen.
     # _mouse_down: whether the user is holding down a mouse button
     #   on the pygame window.
     # _map: the Map object responsible for converting between long/lat
     #   coordinates and the pixels of the visualization window.
+    # _writer: the FrameWriter that saves the frames, or None if this
+    #   visualizer shows them in a window.
+    render_policy: RenderPolicy
     _screen: pygame.Surface
     _mouse_down: bool
     _map: 'Map'
+    _writer: Optional['FrameWriter']
 
-    def __init__(self) -> None:
-        """Initialize this visualization.
+    def __init__(self, render_policy: Optional[RenderPolicy] = None,
+                 frame_dir: Optional[str] = None) -> None:
+        """Initialize this visualization, drawing the steps chosen by
+        <render_policy>, or every step if it is None.
+
+        If <frame_dir> is given, this visualizer is offscreen: it opens no
+        window, and saves its frames as PNG files in the folder <frame_dir>.
         """
+        self.render_policy = render_policy or RenderPolicy()
         pygame.init()
-        self._screen = pygame.display.set_mode(
-            SCREEN_SIZE, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        if frame_dir is None:
+            self._screen = pygame.display.set_mode(
+                SCREEN_SIZE, pygame.HWSURFACE | pygame.DOUBLEBUF)
+            self._writer = None
+        else:
+            self._screen = pygame.Surface(SCREEN_SIZE)
+            self._writer = FrameWriter(frame_dir)
         self._screen.fill(WHITE)
         self._mouse_down = False
         self._map = Map(SCREEN_SIZE)
 
-        # Initial render. Pass in datetime.now() as an dummy value.
-        self.render_drawables([], datetime.now())
+        if self._writer is None:
+            # Initial render. Pass in datetime.now() as an dummy value.
+            self.render_drawables([], datetime.now())
+
+    def should_render(self, time: datetime, final: bool = False) -> bool:
+        """Return whether the simulation step at <time> should be drawn,
+        according to this visualizer's render policy. If <final> is True, it
+        is the last step of a run, which is always drawn.
+        """
+        return self.render_policy.claim_frame(time, final)
+
+    def visible_area(self) -> Tuple[Tuple[float, float],
+                                    Tuple[float, float]]:
+        """Return the smallest and largest (long, lat) coordinates of the
+        objects that can be seen in the current view of the map.
+        """
+        return self._map.visible_area()
 
     def render_drawables(self, drawables: List[Drawable],
                          time: datetime) -> None:
@@ -72,15 +212,25 @@ class Visualizer:
         # Add all of the objects onto the screen
         self._map.render_objects(drawables, self._screen, time)
 
-        # Show the new image
-        pygame.display.flip()
+        # Show the new image, or save it if this visualizer is offscreen
+        if self._writer is None:
+            pygame.display.flip()
+        else:
+            self._writer.write(self._screen)
 
     def handle_window_events(self) -> bool:
         """Handle any user events triggered through the pygame window.
 
         Return True if the user closed the window (by pressing the 'X'),
         and False otherwise.
+
+        An offscreen visualizer has no window, so it closes its frame
+        writer, which waits until all of its frames have been saved, and
+        returns True.
         """
+        if self._writer is not None:
+            self._writer.close()
+            return True
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return True
@@ -88,9 +238,9 @@ class Visualizer:
                 if event.button == 1:
                     self._mouse_down = True
                 elif event.button == 4:
-                    self._map.zoom(-0.1)
+                    self._map.zoom(-ZOOM_STEP)
                 elif event.button == 5:
-                    self._map.zoom(0.1)
+                    self._map.zoom(ZOOM_STEP)
             elif event.type == pygame.MOUSEBUTTONUP:
                 self._mouse_down = False
             elif event.type == pygame.MOUSEMOTION:
@@ -112,9 +262,30 @@ class Map:
     max_coords:
         the maximum long/lat coordinates
     """
+    # === Private attributes ===
+    # _sprites: maps each sprite file to its image at every zoom level,
+    #   indexed by the number of ZOOM_STEPs above MIN_ZOOM. The images are
+    #   loaded and scaled only once, so rendering a frame only blits them.
+    # _mipmaps: the map image at successively halved resolutions, starting
+    #   with the full image. None of them is smaller than the screen.
+    # _view: the scaled view last returned by get_current_view, or None.
+    # _view_key: the (x offset, y offset, zoom) that _view was scaled for.
+    # _pixels: the pixel coordinates of every drawable that doesn't move,
+    #   that is, every drawable but a ride, drawn since the view last changed.
+    # _pixels_key: the (x offset, y offset, zoom) that _pixels is for.
+    # _motions: the motions of the rides drawn recently, to calculate the
+    #   positions of the rides in each frame from, or None if no rides have
+    #   been drawn yet.
     image: pygame.image
     min_coords: Tuple[float, float]
     max_coords: Tuple[float, float]
+    _sprites: Dict[str, List[pygame.Surface]]
+    _mipmaps: List[pygame.Surface]
+    _view: Optional[pygame.Surface]
+    _view_key: Tuple[int, int, float]
+    _pixels: Dict[Drawable, Tuple[int, int]]
+    _pixels_key: Tuple[int, int, float]
+    _motions: Optional['RideMotions']
 
     def __init__(self, screendims: Tuple[int, int]) -> None:
         """Initialize this map for the given screen dimensions.
@@ -128,20 +299,107 @@ class Map:
         self._yoffset = 0
         self._zoom = 1
         self.screensize = screendims
+        self._sprites = {}
+
+        self._mipmaps = [self.image]
+        width, height = self.image.get_size()
+        while width // 2 >= screendims[0] and height // 2 >= screendims[1]:
+            width, height = width // 2, height // 2
+            self._mipmaps.append(pygame.transform.smoothscale(
+                self._mipmaps[-1], (width, height)))
+        self._view = None
+        self._view_key = (0, 0, 0)
+        self._pixels = {}
+        self._pixels_key = (0, 0, 0)
+        self._motions = None
 
     def render_objects(self, drawables: List[Drawable],
                        screen: pygame.Surface, time: datetime) -> None:
         """Render the given objects onto the given screen.
 
-        Calculate their positions based on the given time.
+        Calculate their positions based on the given time. The pixel
+        coordinates of all rides are calculated together, in one step, from
+        the motions of the rides kept since earlier frames, which needs
+        NumPy; without it, each ride is converted on its own.
+        Stations never move, so theirs are only calculated again after the
+        map has been panned or zoomed. Objects that are off the screen are
+        skipped.
         """
+        level = self._zoom_level()
+        view_key = (self._xoffset, self._yoffset, self._zoom)
+        if view_key != self._pixels_key:
+            self._pixels = {}
+            self._pixels_key = view_key
+
+        rides = []
         for drawable in drawables:
-            latlong_position = drawable.get_position(time)
-            sprite_position = self._latlong_to_screen(latlong_position)
-            sprite_file = os.path.join(os.path.dirname(__file__),
-                                       drawable.sprite)
-            screen.blit(pygame.image.load(sprite_file),
-                        sprite_position)
+            if isinstance(drawable, Ride):
+                rides.append(drawable)
+            elif drawable not in self._pixels:
+                self._pixels[drawable] = self._latlong_to_screen(
+                    drawable.get_position(time))
+        ride_pixels = iter(self._ride_pixels(rides, time))
+
+        width, height = screen.get_size()
+        for drawable in drawables:
+            if isinstance(drawable, Ride):
+                x, y = next(ride_pixels)
+            else:
+                x, y = self._pixels[drawable]
+            if not (-SPRITE_MARGIN < x < width and
+                    -SPRITE_MARGIN < y < height):
+                continue
+            sprites = self._sprites.get(drawable.sprite)
+            if sprites is None:
+                sprites = self._load_sprite(drawable.sprite)
+            screen.blit(sprites[level], (x, y))
+
+    def _ride_pixels(self, rides: List[Ride],
+                     time: datetime) -> List[Tuple[int, int]]:
+        """Return the pixel coordinates of each of <rides> at <time>.
+        """
+        if not rides:
+            return []
+        if self._motions is None:
+            try:
+                from ridetable import RideMotions
+            except ImportError:
+                return [self._latlong_to_screen(ride.get_position(time))
+                        for ride in rides]
+            self._motions = RideMotions()
+        return self._to_screen(self._motions.positions(rides, time)).tolist()
+
+    def _zoom_level(self) -> int:
+        """Return the number of ZOOM_STEPs between MIN_ZOOM and the current
+        zoom.
+        """
+        level = round((self._zoom - MIN_ZOOM) / ZOOM_STEP)
+        return min(max(level, 0), round((MAX_ZOOM - MIN_ZOOM) / ZOOM_STEP))
+
+    def _load_sprite(self, sprite: str) -> List[pygame.Surface]:
+        """Load the given sprite file, cache it scaled for every zoom level,
+        and return the cached images.
+
+        Sprites grow with the square root of the zoom, so that they stay
+        readable without covering the map when zoomed in.
+        """
+        image = pygame.image.load(os.path.join(os.path.dirname(__file__),
+                                               sprite))
+        # Converting needs a display, which offscreen visualizers don't have.
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        width, height = image.get_size()
+
+        variants = []
+        for level in range(round((MAX_ZOOM - MIN_ZOOM) / ZOOM_STEP) + 1):
+            scale = math.sqrt(MIN_ZOOM + level * ZOOM_STEP)
+            if level == 0 and scale == 1:
+                variants.append(image)
+            else:
+                variants.append(pygame.transform.smoothscale(
+                    image, (round(width * scale), round(height * scale))))
+        self._sprites[sprite] = variants
+        return variants
 
     def _latlong_to_screen(self,
                            location: Tuple[float, float]) -> Tuple[int, int]:
@@ -162,6 +420,55 @@ class Map:
                   self.image.get_height())
         return x, y
 
+    def _to_screen(self, locations: 'np.ndarray') -> 'np.ndarray':
+        """Convert an array of (long, lat) rows into an array of (x, y)
+        pixel rows.
+
+        Each row is converted exactly as _latlong_to_screen would convert
+        it, but all of the rows are converted together.
+        """
+        import numpy as np
+        image_size = np.array(self.image.get_size())
+        image_xy = np.rint((locations - self.min_coords) /
+                           np.subtract(self.max_coords, self.min_coords) *
+                           image_size)
+        screen_xy = np.rint((image_xy - (self._xoffset, self._yoffset)) *
+                            self._zoom * np.array(self.screensize) /
+                            image_size)
+        return screen_xy.astype(int)
+
+    def _screen_to_latlong(self,
+                           position: Tuple[int, int]) -> Tuple[float, float]:
+        """Convert the given pixel coordinates into (long, lat) coordinates.
+
+        This undoes _latlong_to_screen, apart from its rounding.
+        """
+        x = position[0] * self.image.get_width() / \
+            (self._zoom * self.screensize[0]) + self._xoffset
+        y = position[1] * self.image.get_height() / \
+            (self._zoom * self.screensize[1]) + self._yoffset
+
+        return (self.min_coords[0] + x / self.image.get_width() *
+                (self.max_coords[0] - self.min_coords[0]),
+                self.min_coords[1] + y / self.image.get_height() *
+                (self.max_coords[1] - self.min_coords[1]))
+
+    def visible_area(self) -> Tuple[Tuple[float, float],
+                                    Tuple[float, float]]:
+        """Return the smallest and largest (long, lat) coordinates of the
+        objects that can be seen in the current view.
+
+        Sprites are drawn below and to the right of their positions, so the
+        area reaches SPRITE_MARGIN pixels past the top and left of the
+        screen.
+        """
+        corners = [self._screen_to_latlong((-SPRITE_MARGIN, -SPRITE_MARGIN)),
+                   self._screen_to_latlong(self.screensize)]
+        return ((min(corners[0][0], corners[1][0]),
+                 min(corners[0][1], corners[1][1])),
+                (max(corners[0][0], corners[1][0]),
+                 max(corners[0][1], corners[1][1])))
+
     def pan(self, dp: Tuple[int, int]) -> None:
         """Pan the view in the image by (dx, dy) screenspace pixels.
         """
@@ -174,7 +481,8 @@ class Map:
 
         The centre of the zoom is the top-left corner of the visible region.
         """
-        if (self._zoom >= 4 and dx > 0) or (self._zoom <= 1 and dx < 0):
+        if (self._zoom >= MAX_ZOOM and dx > 0) or \
+                (self._zoom <= MIN_ZOOM and dx < 0):
             return
 
         self._zoom += dx
@@ -193,24 +501,168 @@ class Map:
 
     def get_current_view(self) -> pygame.Surface:
         """Get the subimage to display to screen from the map.
+
+        The view is only rescaled after the map has been panned or zoomed.
+        """
+        view_key = (self._xoffset, self._yoffset, self._zoom)
+        if self._view is None or view_key != self._view_key:
+            self._view = self._scale_view()
+            self._view_key = view_key
+        return self._view
+
+    def _scale_view(self) -> pygame.Surface:
+        """Scale the visible part of the map to the size of the screen.
+
+        The smallest mipmap that still has at least one pixel per screen
+        pixel is used, so zooming out doesn't scale down the full image.
         """
         raw_width = self.image.get_width()
         raw_height = self.image.get_height()
         zoom_width = round(raw_width / self._zoom)
         zoom_height = round(raw_height / self._zoom)
 
-        mapsegment = self.image.subsurface(((self._xoffset, self._yoffset),
-                                            (zoom_width, zoom_height)))
+        level = 0
+        while level + 1 < len(self._mipmaps) and \
+                zoom_width >> (level + 1) >= self.screensize[0] and \
+                zoom_height >> (level + 1) >= self.screensize[1]:
+            level += 1
+        image = self._mipmaps[level]
+        width = min(zoom_width >> level, image.get_width())
+        height = min(zoom_height >> level, image.get_height())
+        x = min(self._xoffset >> level, image.get_width() - width)
+        y = min(self._yoffset >> level, image.get_height() - height)
+
+        mapsegment = image.subsurface(((x, y), (width, height)))
         return pygame.transform.smoothscale(mapsegment, self.screensize)
 
 
+class FrameWriter:
+    """Saves frames as numbered PNG files, on a background thread.
+
+    write only copies the pixels of a frame into a bounded queue, and a
+    writer thread encodes and saves the queued frames, so the simulation
+    doesn't wait for the disk. It only waits if it gets more than
+    <max_queued> frames ahead of the writer thread, which bounds the memory
+    the queue uses.
+
+    Frames are saved as frame_000000.png, frame_000001.png, and so on, in
+    the order they were written.
+
+    The writer thread is started by the first write after the writer is
+    created or closed, and stopped by close, which an offscreen Visualizer
+    calls at the end of every run. A writer can also be used in a with
+    statement, which closes it at the end.
+
+    === Attributes ===
+    frame_dir:
+        the folder that the frames are saved in
+    frames_written:
+        the number of frames passed to write so far
+
+    === Private Attributes ===
+    _queue:
+        the frames waiting to be saved, as (file name, size, RGB bytes)
+        tuples, or None to stop the writer thread
+    _thread:
+        the writer thread, or None if it isn't running
+    _error:
+        the exception that stopped the writer thread, or None
+    """
+    frame_dir: str
+    frames_written: int
+    _queue: Queue
+    _thread: Optional[Thread]
+    _error: Optional[Exception]
+
+    def __init__(self, frame_dir: str, max_queued: int = 64) -> None:
+        """Initialize a writer that saves frames in <frame_dir>, which is
+        created if it doesn't exist, with room for <max_queued> frames in
+        its queue.
+        """
+        os.makedirs(frame_dir, exist_ok=True)
+        self.frame_dir = frame_dir
+        self.frames_written = 0
+        self._queue = Queue(max_queued)
+        self._thread = None
+        self._error = None
+
+    def __enter__(self) -> 'FrameWriter':
+        """Return this writer, to be closed at the end of a with statement.
+        """
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Close this writer at the end of a with statement.
+        """
+        self.close()
+
+    def write(self, frame: pygame.Surface) -> None:
+        """Queue a copy of <frame> to be saved as the next file, starting
+        the writer thread if it isn't running.
+        """
+        self._check()
+        if self._thread is None:
+            # A daemon thread doesn't keep the program running once the
+            # simulation is done; call close first to save every frame.
+            self._thread = Thread(target=self._save_frames, daemon=True)
+            self._thread.start()
+        name = os.path.join(self.frame_dir,
+                            'frame_{:06d}.png'.format(self.frames_written))
+        self._queue.put((name, frame.get_size(),
+                         image_to_bytes(frame, 'RGB')))
+        self.frames_written += 1
+
+    def flush(self) -> None:
+        """Wait until every frame written so far has been saved.
+        """
+        self._queue.join()
+        self._check()
+
+    def close(self) -> None:
+        """Save every frame written so far, and stop the writer thread.
+
+        Writing another frame afterwards starts the thread again.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def _check(self) -> None:
+        """Raise the exception that stopped the writer thread, if any.
+        """
+        if self._error is not None:
+            raise self._error
+
+    def _save_frames(self) -> None:
+        """Save the frames in the queue until told to stop. Run by the
+        writer thread.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    name, size, pixels = item
+                    pygame.image.save(
+                        image_from_bytes(pixels, size, 'RGB'), name)
+            except (OSError, pygame.error) as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'datetime', 'os', 'pygame',
-            'bikeshare'
+            'datetime', 'math', 'numpy', 'os', 'pygame', 'queue',
+            'threading',
+            'time',
+            'bikeshare', 'ridetable'
         ],
         'generated-members': 'pygame.*'
     })
@@ -0,0 +1,148 @@
+"""Bike-share simulation - Synthetic workloads
+
+This file generates station files and ride files of any size, in the same
+formats as stations.json and sample_rides.csv, so that the simulation can be
+tried on far more data than the samples hold.
+
+The data is random but reproducible: the same arguments and seed always give
+the same files. Stations are spread around downtown Montreal, and some are
+much busier than others. Rides cluster around a morning and an evening rush
+hour. In the morning they tend to end downtown, and in the evening they tend
+to start there, so busy stations run out of bikes or spots as they would in
+real life.
+
+Usage: python workload.py <stations> <rides> <stations file> <rides file>
+"""
+from datetime import datetime, timedelta
+import json
+import math
+import sys
+from typing import List, Tuple
+import numpy as np
+
+from simulation import DATETIME_FORMAT
+
+# The day of the first generated ride.
+FIRST_DAY = datetime(2017, 4, 15)
+MINUTES_PER_DAY = 24 * 60
+# The longest ride, in minutes.
+MAX_DURATION = 180
+# The centre of the generated stations, as (long, lat).
+DOWNTOWN = (-73.57, 45.51)
+# The rush hours, as (minute of the day, standard deviation in minutes,
+# share of the day's rides).
+RUSH_HOURS = [(8 * 60, 45, 0.25), (17 * 60 + 15, 60, 0.3)]
+
+
+def generate_stations(stations_file: str, num_stations: int,
+                      seed: int = 0) -> None:
+    """Write <num_stations> random stations to <stations_file>, in the format
+    of stations.json.
+
+    Station ids are '10000', '10001', and so on.
+    """
+    rng = np.random.default_rng(seed)
+    longs = rng.normal(DOWNTOWN[0], 0.045, num_stations)
+    lats = rng.normal(DOWNTOWN[1], 0.03, num_stations)
+    capacities = rng.integers(15, 41, num_stations)
+    bikes = rng.binomial(capacities, 0.5)
+
+    stations = [{'n': str(10000 + i), 's': 'Station {}'.format(10000 + i),
+                 'la': float(lats[i]), 'lo': float(longs[i]),
+                 'da': int(bikes[i]), 'ba': int(capacities[i] - bikes[i])}
+                for i in range(num_stations)]
+    with open(stations_file, 'w', encoding='utf-8') as file:
+        json.dump({'stations': stations}, file)
+
+
+def generate_rides(stations_file: str, rides_file: str, num_rides: int,
+                   seed: int = 0, rides_per_station: int = 30) -> int:
+    """Write <num_rides> random rides between the stations in
+    <stations_file> to <rides_file>, in the format of sample_rides.csv, and
+    return the number of days they cover.
+
+    The rides are spread over enough days that each station starts about
+    <rides_per_station> rides a day, starting on FIRST_DAY. They are written
+    in order of start time, one day at a time, so the whole file is never
+    held in memory.
+    """
+    with open(stations_file, encoding='utf-8') as file:
+        raw_stations = json.load(file)['stations']
+    ids = np.array([s['n'] for s in raw_stations])
+    morning_weights, evening_weights = _station_weights(raw_stations, seed)
+
+    rng = np.random.default_rng(seed + 1)
+    days = max(1, math.ceil(num_rides / (rides_per_station * len(ids))))
+    profile = _day_profile()
+
+    with open(rides_file, 'w') as file:
+        for day in range(days):
+            count = num_rides // days + (day < num_rides % days)
+            times = _minute_strings(FIRST_DAY + timedelta(days=day))
+            starts = np.sort(rng.choice(MINUTES_PER_DAY, count, p=profile))
+            durations = np.clip(np.rint(rng.lognormal(math.log(12), 0.6,
+                                                      count)),
+                                1, MAX_DURATION).astype(np.int64)
+            # Morning rides head downtown; the rest head back out.
+            morning = starts < 12 * 60
+            origins = np.where(
+                morning, rng.choice(len(ids), count, p=morning_weights),
+                rng.choice(len(ids), count, p=evening_weights))
+            destinations = np.where(
+                morning, rng.choice(len(ids), count, p=evening_weights),
+                rng.choice(len(ids), count, p=morning_weights))
+            members = rng.random(count) < 0.8
+
+            file.write(''.join(
+                '{},{},{},{},{},{}\n'.format(
+                    times[start], ids[origin], times[start + duration],
+                    ids[destination], duration * 60, int(member))
+                for start, origin, duration, destination, member in
+                zip(starts.tolist(), origins.tolist(), durations.tolist(),
+                    destinations.tolist(), members.tolist())))
+    return days
+
+
+def _station_weights(raw_stations: List[dict],
+                     seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the probabilities of choosing each of <raw_stations> as the
+    start of a morning ride, and as the end of one.
+
+    Every station gets a random popularity. The second probabilities also
+    favour stations close to DOWNTOWN.
+    """
+    rng = np.random.default_rng(seed)
+    popularity = rng.pareto(2.0, len(raw_stations)) + 1
+    distance = np.hypot([s['lo'] - DOWNTOWN[0] for s in raw_stations],
+                        [s['la'] - DOWNTOWN[1] for s in raw_stations])
+    central = popularity / (distance + 0.01)
+    return popularity / popularity.sum(), central / central.sum()
+
+
+def _day_profile() -> np.ndarray:
+    """Return the probability that a ride starts in each minute of a day.
+
+    Few rides start at night. The rest start evenly through the day, except
+    for the share that start during the RUSH_HOURS.
+    """
+    minutes = np.arange(MINUTES_PER_DAY)
+    daytime = np.where((minutes >= 6 * 60) & (minutes < 23 * 60), 1.0, 0.1)
+    profile = daytime / daytime.sum() * \
+        (1 - sum(share for _, _, share in RUSH_HOURS))
+    for peak, spread, share in RUSH_HOURS:
+        bump = np.exp(-((minutes - peak) / spread) ** 2 / 2)
+        profile += bump / bump.sum() * share
+    return profile / profile.sum()
+
+
+def _minute_strings(day: datetime) -> List[str]:
+    """Return every minute from the start of <day> until MAX_DURATION minutes
+    after it ends, formatted with DATETIME_FORMAT.
+    """
+    return [(day + timedelta(minutes=minute)).strftime(DATETIME_FORMAT)
+            for minute in range(MINUTES_PER_DAY + MAX_DURATION + 1)]
+
+
+if __name__ == '__main__':
+    generate_stations(sys.argv[3], int(sys.argv[1]))
+    generate_rides(sys.argv[3], sys.argv[4], int(sys.argv[2]))